@@ -4,17 +4,23 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 {
     "name": "Online Bank Statements: BankInPlay",
-    "version": "15.0.3.0.3",
+    "version": "15.0.3.2.0",
     "category": "Account",
     "author": "Alquemy",
     "website": "https://www.alquemy.es",
     "license": "AGPL-3",
     "installable": True,
-    "depends": ["account_statement_import_online"],
+    "depends": ["account_statement_import_online", "queue_job"],
     "data": [
         "security/ir.model.access.csv",
+        "data/cron.xml",
+        "data/queue_job.xml",
+        "data/bankinplay_log_retention.xml",
         "views/online_bank_statement_provider.xml",
         "views/res_company.xml",
         "views/bankinplay_log.xml",
+        "views/bankinplay_async_request.xml",
+        "views/bankinplay_callback.xml",
+        "views/bankinplay_log_retention.xml",
     ],
 }
@@ -0,0 +1,53 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+import logging
+
+from odoo import SUPERUSER_ID, api, tools
+
+_logger = logging.getLogger(__name__)
+
+PAYLOAD_COLUMNS = {
+    "request_data": "request_payload_id",
+    "response_data": "response_payload_id",
+    "desencrypt_data": "desencrypt_payload_id",
+    "event_data": "event_payload_id",
+}
+BATCH_SIZE = 1000
+
+
+def migrate(cr, version):
+    """Move the plain text payloads of bankinplay.log to compressed payloads."""
+    columns = [
+        column for column in PAYLOAD_COLUMNS
+        if tools.column_exists(cr, "bankinplay_log", column)
+    ]
+    if not columns:
+        return
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    payload_model = env["bankinplay.log.payload"]
+    last_id = 0
+    while True:
+        cr.execute(
+            "SELECT id, %s FROM bankinplay_log WHERE id > %%s "
+            "ORDER BY id LIMIT %%s" % ", ".join(columns),
+            (last_id, BATCH_SIZE),
+        )
+        rows = cr.fetchall()
+        if not rows:
+            break
+        for row in rows:
+            updates = {
+                PAYLOAD_COLUMNS[column]: payload_model._get_or_create(text).id
+                for column, text in zip(columns, row[1:])
+                if text
+            }
+            if updates:
+                cr.execute(
+                    "UPDATE bankinplay_log SET %s WHERE id = %%s" % ", ".join(
+                        "%s = %%s" % column for column in updates),
+                    list(updates.values()) + [row[0]],
+                )
+        last_id = rows[-1][0]
+        payload_model.invalidate_cache()
+    _logger.info("BankInPlay log payloads moved to bankinplay.log.payload")
+    for column in columns:
+        cr.execute("ALTER TABLE bankinplay_log DROP COLUMN %s" % column)
@@ -0,0 +1,8 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+from odoo import tools
+
+
+def migrate(cr, version):
+    """Drop the BankInPlay credentials stored on the asynchronous requests."""
+    if tools.column_exists(cr, "bankinplay_async_request", "access_data"):
+        cr.execute("ALTER TABLE bankinplay_async_request DROP COLUMN access_data")
@@ -1,6 +1,9 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 from . import bankinplay_interface
 from . import bankinplay_log
+from . import bankinplay_log_payload
+from . import bankinplay_async_request
+from . import bankinplay_callback
 from . import online_bank_statement_provider_bankinplay
 from . import res_company
 from . import callback
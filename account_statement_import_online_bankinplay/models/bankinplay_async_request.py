@@ -0,0 +1,413 @@
+# 2024 Alquemy - José Antonio Fernández Valls <jafernandez@alquemy.es>
+# 2024 Alquemy - Javier de las Heras Gómez <jheras@alquemy.es>
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+import json
+import logging
+from datetime import timedelta
+
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
+
+from odoo.addons.queue_job.exception import RetryableJobError
+
+_logger = logging.getLogger(__name__)
+
+# Seconds before the first status check, upper bound of the exponential
+# backoff between checks and lifetime of a request before it times out.
+ASYNC_POLL_DELAY = 5
+ASYNC_POLL_MAX_DELAY = 300
+ASYNC_DEADLINE = 4 * 3600
+# Items of a continuation committed per transaction.
+ASYNC_BATCH_SIZE = 50
+# Retry delay of a continuation whose batch is being run by another job.
+ASYNC_LOCKED_RETRY = 30
+
+
+def _merge_results(values):
+    """Merge the results of a batch, lists are concatenated."""
+    if values and all(isinstance(value, dict) for value in values):
+        merged = {}
+        for value in values:
+            for key, item in value.items():
+                merged.setdefault(key, []).append(item)
+        return {key: _merge_results(items) for key, items in merged.items()}
+    if values and all(isinstance(value, list) for value in values):
+        return [item for value in values for item in value]
+    return values[0] if values else {}
+
+
+def _merge_args(values):
+    """Merge the continuation arguments of a batch.
+
+    Arguments shared by all the requests are kept as they are, those of
+    each chunk are merged like results.
+    """
+    keys = {key for value in values for key in value}
+    merged = {}
+    for key in keys:
+        items = [value[key] for value in values if key in value]
+        if all(item == items[0] for item in items):
+            merged[key] = items[0]
+        else:
+            merged[key] = _merge_results(items)
+    return merged
+
+
+class BankinplayAsyncRequest(models.Model):
+    _name = "bankinplay.async.request"
+    _description = "Pending BankInPlay asynchronous request"
+    _order = "id desc"
+
+    response_id = fields.Char(string="Response ID", required=True, index=True)
+    triggered_event = fields.Char(string="Triggered Event")
+    company_id = fields.Many2one("res.company", string="Company")
+    state = fields.Selection(
+        [
+            ("pending", "Pending"),
+            ("processed", "Processed"),
+            ("running", "Running"),
+            ("done", "Done"),
+            ("error", "Error"),
+            ("timeout", "Timeout"),
+        ],
+        string="State",
+        default="pending",
+        required=True,
+        index=True,
+    )
+    continuation = fields.Char(
+        string="Continuation",
+        help="Method of bankinplay.interface run as a job with the result "
+        "once BankInPlay has processed the request.",
+    )
+    continuation_args = fields.Text(string="Continuation Arguments")
+    attempts = fields.Integer(string="Attempts", default=0)
+    next_check = fields.Datetime(string="Next Check", index=True)
+    deadline = fields.Datetime(string="Deadline")
+    result_data = fields.Text(string="Result Data")
+    batch_key = fields.Char(
+        string="Batch",
+        index=True,
+        help="Requests of the same chunked export, the continuation runs "
+        "once with their results merged.",
+    )
+    checkpoint = fields.Integer(
+        string="Checkpoint",
+        help="Items of the result already committed by the continuation, "
+        "a continuation run again resumes after them. Stored on the first "
+        "request of a batch.",
+    )
+    failed_items = fields.Text(
+        string="Failed Items",
+        help="Items of the result the continuation could not process, "
+        "with their error.",
+    )
+    retry_failed = fields.Boolean(
+        string="Retry Failed Items",
+        help="The continuation only processes the failed items.",
+    )
+    notes = fields.Text(string="Notes")
+
+    def _get_poll_config(self):
+        params = self.env["ir.config_parameter"].sudo()
+        return {
+            "delay": int(params.get_param(
+                "bankinplay.async_poll_delay", ASYNC_POLL_DELAY)),
+            "max_delay": int(params.get_param(
+                "bankinplay.async_poll_max_delay", ASYNC_POLL_MAX_DELAY)),
+            "deadline": int(params.get_param(
+                "bankinplay.async_deadline", ASYNC_DEADLINE)),
+            "batch_size": int(params.get_param(
+                "bankinplay.async_batch_size", ASYNC_BATCH_SIZE)),
+        }
+
+    @api.model
+    def _register(self, access_data, response_id, continuation=False,
+                  triggered_event="", batch_key=False, **continuation_args):
+        """Track ``response_id`` until BankInPlay has processed it."""
+        config = self._get_poll_config()
+        now = fields.Datetime.now()
+        company = access_data.get("company_id") or self.env.company
+        request = self.sudo().create({
+            "response_id": response_id,
+            "triggered_event": triggered_event,
+            "company_id": company.id,
+            "continuation": continuation or False,
+            "batch_key": batch_key or False,
+            "continuation_args": json.dumps(continuation_args),
+            "next_check": now + timedelta(seconds=config["delay"]),
+            "deadline": now + timedelta(seconds=config["deadline"]),
+        })
+        request._trigger_poll()
+        return request
+
+    def _trigger_poll(self):
+        cron = self.env.ref(
+            "account_statement_import_online_bankinplay.cron_bankinplay_poll_async_requests",
+            raise_if_not_found=False,
+        )
+        if cron:
+            cron.sudo()._trigger(min(self.mapped("next_check")))
+
+    def _get_access_data(self):
+        """Log in with the credentials of the company of the request.
+
+        Credentials are not stored on the request, they are read again
+        every time it is checked.
+        """
+        self.ensure_one()
+        company = self.company_id or self.env.company
+        return company.check_bankinplay_connection()
+
+    @api.model
+    def _cron_poll(self):
+        """Check every due pending request in one pass."""
+        due_requests = self.search(
+            [("state", "=", "pending"),
+             ("next_check", "<=", fields.Datetime.now())],
+            order="next_check",
+        )
+        for request in due_requests:
+            try:
+                with self.env.cr.savepoint():
+                    request._poll()
+            except Exception as e:
+                # Keep polling the other requests, this one is checked again
+                # later until its deadline.
+                _logger.exception(
+                    "BankInPlay request %s could not be checked",
+                    request.response_id)
+                request.invalidate_cache()
+                request._poll_failed(str(e))
+            self.env.cr.commit()
+        pending = self.search([("state", "=", "pending")])
+        if pending:
+            pending._trigger_poll()
+
+    def _poll(self):
+        self.ensure_one()
+        interface_model = self.env["bankinplay.interface"]
+        now = fields.Datetime.now()
+        try:
+            access_data = self._get_access_data()
+            estado = interface_model._get_async_status(
+                access_data, self.response_id)
+            if estado in ("procesado", "terminado"):
+                data = interface_model._get_async_result(
+                    access_data, self.response_id)
+        except UserError as e:
+            _logger.warning(
+                "BankInPlay status check of %s failed: %s", self.response_id, e)
+            estado = False
+        if estado in ("procesado", "terminado"):
+            self.write({
+                "state": "processed",
+                "result_data": json.dumps(data),
+            })
+            self._enqueue_continuation()
+        elif estado == "erroneo":
+            self.write({
+                "state": "error",
+                "notes": _("Error en la solicitud a BankInPlay"),
+            })
+            self._finish_batch()
+        elif self.deadline and self.deadline <= now:
+            self.write({
+                "state": "timeout",
+                "notes": _("BankInPlay did not process the request in time"),
+            })
+            self._finish_batch()
+        else:
+            self._backoff()
+
+    def _backoff(self, values=None):
+        """Check the request again later, waiting longer every time."""
+        self.ensure_one()
+        config = self._get_poll_config()
+        delay = min(config["delay"] * 2 ** self.attempts, config["max_delay"])
+        self.write(dict(values or {}, **{
+            "attempts": self.attempts + 1,
+            "next_check": fields.Datetime.now() + timedelta(seconds=delay),
+        }))
+
+    def _poll_failed(self, error):
+        """Record an unexpected error of a status check.
+
+        The request is checked again later, and set in error with the
+        message once past its deadline.
+        """
+        self.ensure_one()
+        if self.deadline and self.deadline <= fields.Datetime.now():
+            self.write({"state": "error", "notes": error})
+            self._finish_batch()
+        else:
+            self._backoff({"notes": error})
+
+    def _enqueue_continuation(self):
+        self.ensure_one()
+        self.with_delay(
+            identity_key="bankinplay-async-%s" % (self.batch_key or self.id),
+            description="[BANKINPLAY] - %s" % (
+                self.triggered_event or self.response_id),
+        )._run_continuation()
+
+    def _finish_batch(self):
+        """Run the continuation of a batch one of whose requests failed.
+
+        The continuation runs over the results of the processed requests,
+        the failed one keeps its error and can be retried on its own.
+        """
+        self.ensure_one()
+        if not self.batch_key:
+            return
+        processed = self.search([
+            ("batch_key", "=", self.batch_key),
+            ("state", "=", "processed"),
+        ], limit=1)
+        if processed:
+            processed._enqueue_continuation()
+
+    def _run_continuation(self):
+        """Hand the processed result over to its continuation.
+
+        A session lock keeps a single job running the continuation of a
+        batch, as its work is committed along the way.
+        """
+        self.ensure_one()
+        cr = self.env.cr
+        lock_key = self.batch_key or str(self.id)
+        cr.execute(
+            "SELECT pg_try_advisory_lock(hashtext(%s), hashtext(%s))",
+            (self._name, lock_key),
+        )
+        if not cr.fetchone()[0]:
+            raise RetryableJobError(
+                "Continuation of %s is being run" % lock_key,
+                seconds=ASYNC_LOCKED_RETRY,
+                ignore_retry=True,
+            )
+        try:
+            return self._run_claimed_continuation()
+        finally:
+            cr.execute(
+                "SELECT pg_advisory_unlock(hashtext(%s), hashtext(%s))",
+                (self._name, lock_key),
+            )
+
+    def _run_claimed_continuation(self):
+        requests = self._claim()
+        if not requests:
+            return False
+        # Progress of the continuation is stored on the first request.
+        owner = requests[0]
+        if owner.continuation:
+            access_data = owner._get_access_data()
+            interface_model = self.env["bankinplay.interface"].with_context(
+                bankinplay_async_request_id=owner.id)
+            if owner.company_id:
+                interface_model = interface_model.with_company(owner.company_id)
+            getattr(interface_model, owner.continuation)(
+                access_data,
+                _merge_results([
+                    json.loads(request.result_data or "{}")
+                    for request in requests]),
+                **_merge_args([
+                    json.loads(request.continuation_args or "{}")
+                    for request in requests])
+            )
+        requests.write({"state": "done", "retry_failed": False})
+        return True
+
+    def _claim(self):
+        """Mark the processed requests of the batch as running.
+
+        Nothing is claimed while a request of the batch is pending, its
+        own continuation job claims the batch once it is processed.
+        Requests left running by an interrupted job are claimed again.
+        """
+        self.flush()
+        self.env.cr.execute("""
+            UPDATE bankinplay_async_request
+            SET state = 'running', write_uid = %(uid)s,
+                write_date = now() at time zone 'UTC'
+            WHERE (batch_key = %(batch_key)s OR id = %(id)s)
+              AND state IN ('processed', 'running')
+              AND NOT EXISTS (
+                  SELECT 1 FROM bankinplay_async_request r
+                  WHERE r.batch_key = %(batch_key)s AND r.state = 'pending')
+            RETURNING id
+        """, {"uid": self.env.uid, "batch_key": self.batch_key or None,
+              "id": self.id})
+        ids = sorted(row[0] for row in self.env.cr.fetchall())
+        self.invalidate_cache(["state", "write_uid", "write_date"], ids)
+        return self.browse(ids)
+
+    def _process_items(self, items, func):
+        """Run ``func(value)`` for every ``(key, value)`` of ``items``.
+
+        Each item runs in its own savepoint and the work is committed in
+        batches. The position reached and the failed items are stored on
+        the request with every commit, so a continuation that crashed
+        resumes after its last batch. Without a request, as when a
+        continuation is called directly, items are still batched.
+        """
+        failed = json.loads(self.failed_items or "{}")
+        retry_only = self.retry_failed
+        start = self.checkpoint if not retry_only else 0
+        batch_size = max(self._get_poll_config()["batch_size"], 1)
+        processed = 0
+        for position, (key, value) in enumerate(items[start:], start + 1):
+            key = str(key)
+            if retry_only and key not in failed:
+                continue
+            try:
+                with self.env.cr.savepoint():
+                    func(value)
+                failed.pop(key, None)
+            except Exception as e:
+                _logger.warning(
+                    "BankInPlay item %s could not be processed: %s", key, e)
+                failed[key] = str(e)
+                self.env["bankinplay.log"]._log({
+                    "operation_type": "error",
+                    "response_data": _("Error al procesar %s: %s") % (key, e),
+                    "response_id": self.response_id or "",
+                    "triggered_event": self.triggered_event or "",
+                    "status": "error",
+                })
+            processed += 1
+            if processed % batch_size == 0:
+                self._checkpoint(position, failed)
+        self._checkpoint(len(items), failed)
+        return failed
+
+    def _checkpoint(self, position, failed):
+        if self:
+            self.write({
+                "checkpoint": position,
+                "failed_items": json.dumps(failed) if failed else False,
+            })
+        self.env.cr.commit()
+
+    def action_retry_failed(self):
+        """Run the continuation again for the failed items only."""
+        for request in self.filtered("failed_items"):
+            batch = request
+            if request.batch_key:
+                batch = self.search([
+                    ("batch_key", "=", request.batch_key),
+                    ("state", "=", "done"),
+                ])
+            batch.write({"state": "processed"})
+            request.retry_failed = True
+            request._enqueue_continuation()
+
+    def action_retry(self):
+        self.write({
+            "state": "pending",
+            "attempts": 0,
+            "next_check": fields.Datetime.now(),
+            "deadline": fields.Datetime.now() + timedelta(
+                seconds=self._get_poll_config()["deadline"]),
+        })
+        self._trigger_poll()
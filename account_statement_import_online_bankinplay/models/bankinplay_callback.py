@@ -0,0 +1,200 @@
+# 2024 Alquemy - José Antonio Fernández Valls <jafernandez@alquemy.es>
+# 2024 Alquemy - Javier de las Heras Gómez <jheras@alquemy.es>
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+import json
+import logging
+
+from odoo import _, api, fields, models
+
+from odoo.addons.queue_job.exception import RetryableJobError
+
+_logger = logging.getLogger(__name__)
+
+CALLBACK_CHANNEL = "root.bankinplay"
+# Retry delay of a job whose provider queue is being processed by another job.
+CALLBACK_LOCKED_RETRY = 30
+# Retry delay of a callback whose originating request is not logged yet.
+CALLBACK_REQUEST_RETRY = 60
+
+
+class BankinplayCallback(models.Model):
+    _name = "bankinplay.callback"
+    _description = "BankInPlay callback inbox"
+    _order = "id desc"
+
+    event = fields.Selection(
+        [
+            ("lectura_cierre", "Lectura cierre"),
+            ("lectura_intradia", "Lectura intradía"),
+            ("lectura_tarjeta", "Lectura tarjeta"),
+        ],
+        string="Event",
+        required=True,
+    )
+    payload = fields.Text(string="Payload")
+    response_id = fields.Char(string="Response ID", index=True)
+    signature = fields.Char(string="Signature")
+    request_log_id = fields.Many2one(
+        "bankinplay.log", string="Request Log", ondelete="set null")
+    provider_id = fields.Many2one(
+        "online.bank.statement.provider", string="Provider",
+        ondelete="set null", index=True)
+    state = fields.Selection(
+        [
+            ("received", "Received"),
+            ("done", "Done"),
+            ("error", "Error"),
+        ],
+        string="State",
+        default="received",
+        required=True,
+        index=True,
+    )
+    progress = fields.Text(
+        string="Progress",
+        help="Steps already committed, they are skipped when the callback "
+        "is processed again.",
+    )
+    notes = fields.Text(string="Notes")
+
+    _sql_constraints = [
+        (
+            "response_signature_uniq",
+            "unique(response_id, signature)",
+            "This BankInPlay callback has already been received.",
+        ),
+    ]
+
+    @api.model
+    def _receive(self, event, payload, data):
+        """Store a raw callback and queue its processing.
+
+        BankInPlay retries of a callback already received are acknowledged
+        without storing nor processing them again.
+        """
+        response_id = data.get("responseId")
+        signature = data.get("signature")
+        callback = self.search(
+            [("response_id", "=", response_id),
+             ("signature", "=", signature)], limit=1)
+        if callback:
+            if callback.state == "error":
+                callback.action_process()
+            return callback
+        callback = self.create({
+            "event": event,
+            "payload": payload,
+            "response_id": response_id,
+            "signature": signature,
+        })
+        callback._resolve_request()
+        callback._enqueue()
+        return callback
+
+    def _resolve_request(self):
+        """Link the callback to the logged request it answers to.
+
+        Request logs are written when the requesting transaction commits,
+        so a fast callback may arrive before its request is logged.
+        """
+        self.ensure_one()
+        request_log = self.env["bankinplay.log"]._get_request_log(
+            self.response_id, self.signature)
+        if not request_log:
+            return False
+        provider_id = False
+        if request_log.event_data:
+            provider_id = json.loads(request_log.event_data).get("provider_id")
+        self.write({
+            "request_log_id": request_log.id,
+            "provider_id": provider_id,
+        })
+        return True
+
+    def _enqueue(self):
+        """Queue one job per provider, jobs process its callbacks in order."""
+        for provider in self.mapped("provider_id"):
+            self.browse().with_delay(
+                channel=CALLBACK_CHANNEL,
+                identity_key="bankinplay-callback-%s" % provider.id,
+                description=_("[BANKINPLAY] - Callbacks %s") % provider.name,
+            )._process_provider_queue(provider.id)
+        if any(not callback.provider_id for callback in self):
+            self.browse().with_delay(
+                channel=CALLBACK_CHANNEL,
+                identity_key="bankinplay-callback-0",
+                description=_("[BANKINPLAY] - Callbacks"),
+            )._process_provider_queue(False)
+
+    @api.model
+    def _process_provider_queue(self, provider_id):
+        """Process the received callbacks of a provider, oldest first.
+
+        A session advisory lock keeps a single job per provider running, so
+        that statements are always built in the order callbacks arrived.
+        """
+        cr = self.env.cr
+        cr.execute(
+            "SELECT pg_try_advisory_lock(hashtext(%s), %s)",
+            (self._name, provider_id or 0),
+        )
+        if not cr.fetchone()[0]:
+            raise RetryableJobError(
+                "Callbacks of provider %s are being processed" % provider_id,
+                seconds=CALLBACK_LOCKED_RETRY,
+                ignore_retry=True,
+            )
+        try:
+            callbacks = self.search(
+                [("state", "=", "received"),
+                 ("provider_id", "=", provider_id)],
+                order="id",
+            )
+            for callback in callbacks:
+                callback._process()
+                cr.commit()
+        finally:
+            cr.execute(
+                "SELECT pg_advisory_unlock(hashtext(%s), %s)",
+                (self._name, provider_id or 0),
+            )
+        return True
+
+    def _process(self):
+        """Process the callback, resuming after its last committed step."""
+        self.ensure_one()
+        if not self.request_log_id and not self._resolve_request():
+            raise RetryableJobError(
+                "Originating request of callback %s not logged yet"
+                % self.response_id,
+                seconds=CALLBACK_REQUEST_RETRY,
+            )
+        interface_model = self.env["bankinplay.interface"].sudo().with_context(
+            bankinplay_callback_id=self.id)
+        try:
+            interface_model.manage_callback(
+                self.event, json.loads(self.payload))
+        except Exception as e:
+            _logger.exception(
+                "BankInPlay callback %s could not be processed", self.response_id)
+            self.env.cr.rollback()
+            self.write({"state": "error", "notes": str(e)})
+            return False
+        self.state = "done"
+        return True
+
+    def _run_step(self, key, func, *args):
+        """Run ``func`` once for this callback and commit its work."""
+        self.ensure_one()
+        done = json.loads(self.progress or "[]")
+        if key in done:
+            return True
+        with self.env.cr.savepoint():
+            result = func(*args)
+        self.progress = json.dumps(done + [key])
+        self.env.cr.commit()
+        return result
+
+    def action_process(self):
+        self.write({"state": "received", "notes": False})
+        self._enqueue()
@@ -3,11 +3,17 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
 import base64
+import functools
+import hashlib
 import json
 import logging
+import threading
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from requests.adapters import HTTPAdapter
 from dateutil.relativedelta import relativedelta
 from datetime import datetime, date
 
@@ -18,7 +24,6 @@ from odoo.addons.base.models.res_bank import sanitize_account_number
 
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import unpad
-import base64
 
 _logger = logging.getLogger(__name__)
 
@@ -26,6 +31,86 @@ BANKINPLAY_ENDPOINT = "https://app.bankinplay.com/intradia-core"
 BANKINPLAY_ENDPOINT_V1 = BANKINPLAY_ENDPOINT + "/api/v1"
 BANKINPLAY_ENDPOINT_V2 = BANKINPLAY_ENDPOINT + "/api/v2"
 
+BANKINPLAY_POOL_SIZE = 10
+BANKINPLAY_CONNECT_TIMEOUT = 10
+BANKINPLAY_READ_TIMEOUT = 120
+# Seconds before expiry at which a cached token is refreshed, and lifetime
+# assumed for tokens that do not carry an ``exp`` claim.
+BANKINPLAY_TOKEN_MARGIN = 60
+BANKINPLAY_TOKEN_TTL = 600
+# Lifetime in seconds of cached reference data (accounts, cards, ...).
+BANKINPLAY_REFERENCE_TTL = 3600
+# Records encoded and sent per request by chunked exports.
+BANKINPLAY_EXPORT_CHUNK_SIZE = 500
+# Threads sending requests at once when there is no bulk endpoint.
+BANKINPLAY_MAX_WORKERS = 4
+# Field of a lectura movement with the IBAN of its bank account, as the
+# ``cuentaCompleta`` of the accounts listed by the lectura request.
+BANKINPLAY_MOVEMENT_ACCOUNT_FIELD = "cuentaCompleta"
+
+# Keep-alive sessions of this worker, keyed by credentials and pool size.
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _get_session(key, pool_size):
+    """Return the pooled keep-alive session of this worker for ``key``."""
+    with _sessions_lock:
+        session = _sessions.get((key, pool_size))
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({"Accept-Encoding": "gzip, deflate"})
+            _sessions[(key, pool_size)] = session
+        return session
+
+
+# Reference data of this worker:
+# (api key, kind) -> (expiry, cache version, data, index).
+_reference_cache = {}
+_reference_lock = threading.Lock()
+
+# JWT tokens of this worker: api key -> (secret hash, token, expiry).
+_tokens = {}
+_tokens_lock = threading.Lock()
+
+
+def _secret_hash(password):
+    return hashlib.sha256((password or "").encode("utf-8")).hexdigest()
+
+
+def _get_token_expiry(token):
+    """Read the ``exp`` claim of a JWT without verifying its signature."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return time.time() + BANKINPLAY_TOKEN_TTL
+
+
+def _get_cached_token(username, password):
+    with _tokens_lock:
+        cached = _tokens.get(username)
+    if not cached:
+        return False
+    secret_hash, token, expiry = cached
+    if secret_hash != _secret_hash(password):
+        return False
+    if expiry - BANKINPLAY_TOKEN_MARGIN <= time.time():
+        return False
+    return token
+
+
+def _set_cached_token(username, password, token):
+    with _tokens_lock:
+        _tokens[username] = (
+            _secret_hash(password), token, _get_token_expiry(token))
+
 
 class BankinPlayInterface(models.AbstractModel):
     _name = "bankinplay.interface"
@@ -33,16 +118,24 @@ class BankinPlayInterface(models.AbstractModel):
 
     def _get_companies(self, access_data):
         """Get companies from bankingplay."""
-        url = BANKINPLAY_ENDPOINT_V2 + "/entidad/sociedades"
+        return self._get_reference_data(access_data, "companies")
 
-        data = self._get_request(access_data, url, {})
-        return data
+    def _login(self, username, password, force=False):
+        """BankInPlay login returns an access dictionary for further requests.
 
-    def _login(self, username, password):
-        """BankInPlay login returns an access dictionary for further requests."""
+        The token is cached per api key until shortly before it expires,
+        ``force`` discards the cached token and logs in again.
+        """
         url = BANKINPLAY_ENDPOINT + "/clienteApi/jwt_token"
         if not (username and password):
             raise UserError(_("Please fill login and key."))
+        access_token = not force and _get_cached_token(username, password)
+        if access_token:
+            return {
+                "access_token": access_token,
+                "user": username,
+                "pass": password
+            }
         login_params = {
             'user': username,
             'pass': password
@@ -52,8 +145,10 @@ class BankinPlayInterface(models.AbstractModel):
             "Accept": "application/json"
         }
         _logger.info(_("POST request on %s"), url)
-        response = requests.post(
+        response = self._http_request(
+            "POST",
             url,
+            username,
             params=login_params,
             headers=login_headers,
         )
@@ -61,12 +156,97 @@ class BankinPlayInterface(models.AbstractModel):
         access_token = data.get("access_token", False)
         if not access_token:
             raise UserError(_("BankInPlay : no token"))
+        _set_cached_token(username, password, access_token)
         return {
             "access_token": access_token,
             "user": username,
             "pass": password
         }
 
+    def _get_http_config(self):
+        """Pool size and (connect, read) timeouts for BankInPlay requests."""
+        params = self.env["ir.config_parameter"].sudo()
+        return {
+            "pool_size": int(params.get_param(
+                "bankinplay.pool_size", BANKINPLAY_POOL_SIZE)),
+            "timeout": (
+                float(params.get_param(
+                    "bankinplay.connect_timeout", BANKINPLAY_CONNECT_TIMEOUT)),
+                float(params.get_param(
+                    "bankinplay.read_timeout", BANKINPLAY_READ_TIMEOUT)),
+            ),
+        }
+
+    def _http_request(self, method, url, session_key, timeout=None, **kwargs):
+        """Send a request through the pooled session of ``session_key``.
+
+        Connections are kept alive and reused between calls made with the
+        same credentials, gzip encoded responses are decoded transparently.
+        """
+        config = self._get_http_config()
+        session = _get_session(session_key or "", config["pool_size"])
+        try:
+            return session.request(
+                method, url, timeout=timeout or config["timeout"], **kwargs)
+        except requests.exceptions.RequestException as e:
+            raise UserError(
+                _("BankInPlay : connection error on %s: %s") % (url, e)
+            ) from e
+
+    def _authorized_request(self, method, url, access_data, **kwargs):
+        """Send an authenticated request, logging in again once on a 401."""
+        response = self._http_request(
+            method, url, access_data.get("user"),
+            headers=self._get_request_headers(access_data), **kwargs)
+        if response.status_code == 401 and access_data.get("pass"):
+            _logger.info(_("BankInPlay token rejected, logging in again"))
+            access_data.update(self._login(
+                access_data["user"], access_data["pass"], force=True))
+            response = self._http_request(
+                method, url, access_data.get("user"),
+                headers=self._get_request_headers(access_data), **kwargs)
+        return response
+
+    def _post_concurrently(self, access_data, url, payloads):
+        """POST each of ``payloads`` to ``url`` from a bounded thread pool.
+
+        Threads only send the requests through the pooled session of the
+        credentials, nothing touches the environment outside this thread.
+        Returns the response of each payload, in order, or the exception
+        raised sending it.
+        """
+        config = self._get_http_config()
+        workers = int(self.env["ir.config_parameter"].sudo().get_param(
+            "bankinplay.max_workers", BANKINPLAY_MAX_WORKERS))
+        workers = max(min(workers, config["pool_size"]), 1)
+        session = _get_session(access_data.get("user") or "", config["pool_size"])
+
+        def post_all(indexes, headers):
+            def post(index):
+                try:
+                    return session.post(
+                        url, data=payloads[index], headers=headers,
+                        timeout=config["timeout"])
+                except requests.exceptions.RequestException as e:
+                    return e
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                return list(executor.map(post, indexes))
+
+        responses = post_all(
+            range(len(payloads)), self._get_request_headers(access_data))
+        rejected = [
+            index for index, response in enumerate(responses)
+            if getattr(response, "status_code", None) == 401
+        ]
+        if rejected and access_data.get("pass"):
+            _logger.info(_("BankInPlay token rejected, logging in again"))
+            access_data.update(self._login(
+                access_data["user"], access_data["pass"], force=True))
+            retried = post_all(rejected, self._get_request_headers(access_data))
+            for index, response in zip(rejected, retried):
+                responses[index] = response
+        return responses
+
     def _get_request_headers(self, access_data):
         """Get headers with authorization for further bankinplay requests."""
         return {
@@ -75,103 +255,197 @@ class BankinPlayInterface(models.AbstractModel):
             "Content-Type": "application/json"
         }
 
-    def _get_pending_async_request(self, access_data, data, params=[]):
-        
+    def _register_async_request(self, access_data, data, continuation=False,
+                                triggered_event="", batch_key=False,
+                                **continuation_args):
+        """Hand an accepted asynchronous request over to the poller.
+
+        ``continuation`` names a method of this model that is run as a job
+        with ``(access_data, result, **continuation_args)`` once BankInPlay
+        has processed the request. Requests sharing a ``batch_key`` run it
+        once, with their results merged.
+        """
         _logger.info(
             _("`POST` response data %s"), data
         )
 
-        log_entry = self.env['bankinplay.log'].create({
+        self.env['bankinplay.log']._log({
             'operation_type': 'response',
-            #'request_data': json.dumps(params),
             'response_data': json.dumps(data),
             'status': 'success',
-            #'notes': json.dumps(headers),
-            # 'response_id': data.get('responseId', ''),
-            # 'signature': data.get('signature', ''),
-            #'event_data': json.dumps(event_data),
-            #'triggered_event': str(url)
+            'response_id': data.get('responseId', ''),
+            'triggered_event': triggered_event,
         })
 
         responseId = data.get('responseId', '')
         if not responseId:
             raise UserError('La petición no ha sido aceptada por BankInPlay')
 
+        return self.env['bankinplay.async.request']._register(
+            access_data, responseId, continuation, triggered_event,
+            batch_key=batch_key, **continuation_args
+        )
+
+    def _get_export_chunk_size(self):
+        return max(int(self.env["ir.config_parameter"].sudo().get_param(
+            "bankinplay.export_chunk_size", BANKINPLAY_EXPORT_CHUNK_SIZE)), 1)
+
+    def _export_in_chunks(self, access_data, url, records, build,
+                          continuation=False, triggered_event="",
+                          on_chunk=None, **continuation_args):
+        """POST ``records`` to ``url`` one chunk at a time.
+
+        ``build(chunk)`` returns the params of a chunk, or ``None`` to skip
+        it, and the continuation arguments of its own. Only one chunk is
+        encoded at a time. Every chunk is an asynchronous request of its
+        own, all of them in flight at once, and ``continuation`` runs once
+        with their results merged, or right away when nothing is sent.
+        ``on_chunk(request, chunk_args)`` is called after each chunk is
+        sent.
+        """
+        batch_key = uuid.uuid4().hex
+        chunk_size = self._get_export_chunk_size()
+        async_requests = self.env['bankinplay.async.request']
+        for index, start in enumerate(range(0, len(records), chunk_size), 1):
+            chunk = records[start:start + chunk_size].with_prefetch()
+            params, chunk_args = build(chunk)
+            if params is not None:
+                request = self._register_async_request(
+                    access_data,
+                    self.with_context(bankinplay_chunk=index)._post_request(
+                        access_data, url, {}, json.dumps(params)),
+                    continuation, triggered_event, batch_key=batch_key,
+                    **dict(continuation_args, **chunk_args))
+                if on_chunk:
+                    on_chunk(request, chunk_args)
+                async_requests |= request
+            del params
+            # Do not keep the records already sent in the cache.
+            chunk.invalidate_cache(ids=chunk.ids)
+        if not async_requests and continuation:
+            # Nothing to send, the continuation runs right away.
+            getattr(self, continuation)(access_data, {}, **continuation_args)
+        return async_requests
+
+    def _get_async_status(self, access_data, responseId, params=[]):
+        """Processing state (``estado``) of an asynchronous request."""
         url = BANKINPLAY_ENDPOINT_V1 + "/statement/status/" + responseId
         data = self._get_request(access_data, url, params)
+        return data.get('estado', '')
 
-        while data['estado'] != 'procesado' and data['estado'] != 'terminado':
-            time.sleep(5)
-            data = self._get_request(access_data, url, params)
-            estado = data.get('estado', '')
-            if estado == 'erroneo':
-                raise UserError('Error en la solicitud de transacciones')
-
+    def _get_async_result(self, access_data, responseId, params=[]):
+        """Result of an asynchronous request already processed."""
         url = (
             BANKINPLAY_ENDPOINT_V1
             + "/respuestaAsincronaApi/recogida?responseId="
             + responseId
         )
-        data = self._get_request(access_data, url, params)
-        return data
+        return self._get_request(access_data, url, params)
 
     def _set_access_account(self, access_data, account_number):
         """Set bankinplay account for bank account in access_data."""
-        url = BANKINPLAY_ENDPOINT_V2 + "/entidad/cuentaBancaria"
-        _logger.info(_("GET request on %s"), url)
-        response = requests.get(
-            url, params={}, headers=self._get_request_headers(access_data)
-        )
-        data = self._get_response_data(response, access_data)
-        for bankinplay_account in data:
-            bankinplay_iban = sanitize_account_number(
-                bankinplay_account.get("cuentaCompleta", {})
-            )
-            if bankinplay_iban == account_number:
-                access_data["bankinplay_account"] = bankinplay_account.get(
-                    "id")
-                return access_data
+        bankinplay_account = self._get_reference_index(
+            access_data, "accounts").get(account_number)
+        if bankinplay_account:
+            access_data["bankinplay_account"] = bankinplay_account.get("id")
+            return access_data
         # If we get here, we did not find Ponto account for bank account.
         raise UserError(
             _("BankInPlay : wrong configuration, account %s not found in %s")
-            % (account_number, data)
+            % (account_number, self._get_reference_data(access_data, "accounts"))
         )
 
     def _set_access_card(self, access_data, account_number):
         """Set bankinplay account for bank card in access_data."""
-        url = BANKINPLAY_ENDPOINT_V2 + "/entidad/tarjeta"
-        _logger.info(_("GET request on %s"), url)
-        response = requests.get(
-            url, params={}, headers=self._get_request_headers(access_data)
-        )
-        data = self._get_response_data(response, access_data)
-        for bankinplay_account in data:
-            bankinplay_card_number = sanitize_account_number(
-                bankinplay_account.get("num_tarjeta", {})
-            )
-            check_company = False
-            if bankinplay_card_number == account_number:
-                get_companies = self._get_companies(access_data)
-                for company in get_companies:
-                    if company['nif'] == bankinplay_account.get("cif_sociedad", ''):
-                        check_company = True
-                        access_data["bankinplay_company_card"] = company.get(
-                            "id")
-                        break
-
-                if not check_company:
-                    raise UserError(
-                        _("BankInPlay : wrong configuration, company %s not found in %s")
-                        % (self.vat, get_companies)
-                    )
-
-                return access_data
+        bankinplay_card = self._get_reference_index(
+            access_data, "cards").get(account_number)
+        if bankinplay_card:
+            cif = bankinplay_card.get("cif_sociedad", '')
+            company = self._get_reference_index(
+                access_data, "companies").get(cif)
+            if not company:
+                raise UserError(
+                    _("BankInPlay : wrong configuration, company %s not found in %s")
+                    % (cif, self._get_companies(access_data))
+                )
+            access_data["bankinplay_company_card"] = company.get("id")
+            return access_data
         # If we get here, we did not find Ponto account for bank account.
         raise UserError(
             _("BankInPlay : wrong configuration, account %s not found in %s")
-            % (account_number, data)
+            % (account_number, self._get_reference_data(access_data, "cards"))
         )
 
+    # DATOS DE REFERENCIA
+
+    def _get_reference_urls(self):
+        """Endpoints of the reference data cached per credentials."""
+        return {
+            "accounts": BANKINPLAY_ENDPOINT_V2 + "/entidad/cuentaBancaria",
+            "cards": BANKINPLAY_ENDPOINT_V2 + "/entidad/tarjeta",
+            "companies": BANKINPLAY_ENDPOINT_V2 + "/entidad/sociedades",
+        }
+
+    def _get_reference_key(self, kind, item):
+        """Key of ``item`` in the local index of the ``kind`` reference data."""
+        if kind == "accounts":
+            return sanitize_account_number(item.get("cuentaCompleta"))
+        if kind == "cards":
+            return sanitize_account_number(item.get("num_tarjeta"))
+        if kind == "companies":
+            return item.get("nif")
+        return item.get("id")
+
+    def _get_reference_data(self, access_data, kind):
+        """Reference data of ``kind``, cached for the credentials."""
+        return self._get_reference_entry(access_data, kind)[0]
+
+    def _get_reference_index(self, access_data, kind):
+        """Reference data of ``kind`` indexed by ``_get_reference_key``."""
+        return self._get_reference_entry(access_data, kind)[1]
+
+    def _get_reference_entry(self, access_data, kind):
+        params = self.env["ir.config_parameter"].sudo()
+        version = params.get_param("bankinplay.reference_cache_version", "0")
+        key = (access_data.get("user"), kind)
+        with _reference_lock:
+            cached = _reference_cache.get(key)
+        if cached and cached[0] > time.time() and cached[1] == version:
+            return cached[2], cached[3]
+        data = self._get_request(
+            access_data, self._get_reference_urls()[kind], {})
+        index = {}
+        if isinstance(data, list):
+            for item in data:
+                item_key = self._get_reference_key(kind, item)
+                if item_key:
+                    index.setdefault(item_key, item)
+        ttl = int(params.get_param(
+            "bankinplay.reference_cache_ttl", BANKINPLAY_REFERENCE_TTL))
+        with _reference_lock:
+            _reference_cache[key] = (time.time() + ttl, version, data, index)
+        return data, index
+
+    def _invalidate_reference_cache(self, access_data=None, kinds=None):
+        """Forget cached reference data, of ``access_data`` only if given.
+
+        Without ``kinds`` the cache version is also bumped, so that the
+        other workers drop their cached data as well.
+        """
+        with _reference_lock:
+            for key in list(_reference_cache):
+                if access_data and key[0] != access_data.get("user"):
+                    continue
+                if kinds and key[1] not in kinds:
+                    continue
+                del _reference_cache[key]
+        if not kinds:
+            params = self.env["ir.config_parameter"].sudo()
+            version = int(params.get_param(
+                "bankinplay.reference_cache_version", "0"))
+            params.set_param(
+                "bankinplay.reference_cache_version", str(version + 1))
+
     def _get_transactions_from_data(self, data, event_data):
         """Get all transactions that are in the ponto response data."""
         provider_id = self.env["online.bank.statement.provider"].browse(
@@ -185,12 +459,13 @@ class BankinPlayInterface(models.AbstractModel):
                 data,
             )
         elif isinstance(trans, dict):
-            movimientos = trans.get("movimientos", [])
-            if movimientos:
-                trans = []
-                for movimiento in movimientos:
-                    if movimiento.get('num_tarjeta') == provider_id.bankinplay_card_number:
-                        trans.append(movimiento)
+            trans = trans.get("movimientos", [])
+            if not event_data.get("cards"):
+                # Shared card lecturas are split by card number afterwards.
+                trans = [
+                    movimiento for movimiento in trans
+                    if movimiento.get('num_tarjeta') == provider_id.bankinplay_card_number
+                ]
 
         _logger.info(
             _("%d transactions present in response data"),
@@ -209,7 +484,8 @@ class BankinPlayInterface(models.AbstractModel):
         _logger.info(
             _("GET request to %s with headers %s and params %s"), url, headers, params
         )
-        response = requests.get(url, params=params, headers=headers)
+        response = self._authorized_request(
+            "GET", url, access_data, params=params)
         return self._get_response_data(response, access_data)
 
     def _simple_post_request(self, access_data, url, params, data=None):
@@ -219,8 +495,8 @@ class BankinPlayInterface(models.AbstractModel):
         _logger.info(
             _("`POST` request to %s with headers %s and params %s"), url, headers, params
         )
-        response = requests.post(
-            url, params=params, headers=headers, data=data)
+        response = self._authorized_request(
+            "POST", url, access_data, params=params, data=data)
         data = json.loads(response.text)
         return data
 
@@ -229,23 +505,29 @@ class BankinPlayInterface(models.AbstractModel):
         headers = self._get_request_headers(access_data)
 
         _logger.info(
-            _("`POST` request to %s with headers %s and params %s and data %s"), url, headers, params, data
+            _("`POST` request to %s with headers %s and params %s and %s bytes of data"),
+            url, headers, params, len(data or "")
         )
 
-        log_entry = self.env['bankinplay.log'].create({
+        # The payload itself is only kept at the ``full`` log level.
+        notes = _("%s bytes") % len(data or "")
+        if self.env.context.get('bankinplay_chunk'):
+            notes = _("%s, chunk %s") % (
+                notes, self.env.context['bankinplay_chunk'])
+        self.env['bankinplay.log']._log({
             'operation_type': 'request',
-            'request_data': json.dumps(data),
+            'request_data': data if isinstance(data, str) else json.dumps(data),
             #'response_data': json.dumps(data),
             'status': 'success',
-            'notes': json.dumps(headers),
+            'notes': notes,
             # 'response_id': data.get('responseId', ''),
             # 'signature': data.get('signature', ''),
             #'event_data': json.dumps(event_data),
             'triggered_event': str(url)
         })
 
-        response = requests.post(
-            url, params=params, headers=headers, data=data)
+        response = self._authorized_request(
+            "POST", url, access_data, params=params, data=data)
         return self._get_response_data(response, access_data)
 
     def _put_request(self, access_data, url, params, data=None):
@@ -255,7 +537,8 @@ class BankinPlayInterface(models.AbstractModel):
         _logger.info(
             _("`POST` request to %s with headers %s and params %s"), url, headers, params
         )
-        response = requests.put(url, params=params, headers=headers, data=data)
+        response = self._authorized_request(
+            "PUT", url, access_data, params=params, data=data)
         return self._get_response_data(response, access_data)
 
     def _delete_request(self, access_data, url, params, data=None):
@@ -265,8 +548,8 @@ class BankinPlayInterface(models.AbstractModel):
         _logger.info(
             _("`POST` request to %s with headers %s and params %s"), url, headers, params
         )
-        response = requests.delete(
-            url, params=params, headers=headers, data=data)
+        response = self._authorized_request(
+            "DELETE", url, access_data, params=params, data=data)
         return self._get_response_data(response, access_data)
 
     def _get_response_data(self, response, access_data=False):
@@ -305,7 +588,7 @@ class BankinPlayInterface(models.AbstractModel):
             decrypted_bytes = unpad(cipher.decrypt(
                 encrypted_bytes), AES.block_size)
             
-            log_entry = self.env['bankinplay.log'].create({
+            self.env['bankinplay.log']._log({
                 'operation_type': 'response',
                 #'request_data': json.dumps(params),
                 'response_data': decrypted_bytes.decode('utf-8'),
@@ -319,7 +602,7 @@ class BankinPlayInterface(models.AbstractModel):
 
             return json.loads(decrypted_bytes.decode('utf-8'))
         else:
-            log_entry = self.env['bankinplay.log'].create({
+            self.env['bankinplay.log']._log({
                 'operation_type': 'response',
                 #'request_data': json.dumps(params),
                 'response_data': json.dumps(data),
@@ -332,7 +615,8 @@ class BankinPlayInterface(models.AbstractModel):
             })
             return data
 
-    def _get_transactions(self, access_data, date_since, date_until, provider_id):
+    def _get_transactions(self, access_data, date_since, date_until, provider_id,
+                          providers=None):
         """Get transactions from bankingplay, using last_identifier as pointer.
 
         Note that Ponto has the transactions in descending order. The first
@@ -347,7 +631,7 @@ class BankinPlayInterface(models.AbstractModel):
             "deshabilitar_callback": False,
             "fechaDesdeOperacion": date_since.strftime("%d/%m/%Y"),
             "fechaHastaOperacion": date_until.strftime("%d/%m/%Y"),
-            "cuentasBancarias": [access_data.get("bankinplay_account")] if access_data.get("bankinplay_account", False) else []
+            "cuentasBancarias": self._get_lectura_accounts(access_data),
         }
 
         data = self._simple_post_request(access_data, url, params)
@@ -356,9 +640,11 @@ class BankinPlayInterface(models.AbstractModel):
             "event": "lectura_intradia",
             "date_since": date_since.strftime("%Y/%m/%d"),
             "date_until": date_until.strftime("%Y/%m/%d"),
-            "provider_id": provider_id.id,
+            "provider_id": provider_id[:1].id,
             "access_data": access_data
         }
+        if providers:
+            event_data["providers"] = providers
 
         log_entry = self.env['bankinplay.log'].create({
             'operation_type': 'request',
@@ -372,7 +658,136 @@ class BankinPlayInterface(models.AbstractModel):
             'triggered_event': 'lectura_intradia'
         })
 
-    def _get_closing_transactions(self, access_data, date_since, date_until, provider_id):
+    def _get_lectura_accounts(self, access_data):
+        """BankInPlay accounts a lectura request is made for."""
+        if access_data.get("bankinplay_accounts"):
+            return access_data["bankinplay_accounts"]
+        if access_data.get("bankinplay_account", False):
+            return [access_data.get("bankinplay_account")]
+        return []
+
+    def _queue_lectura(self, provider_id, date_since, date_until):
+        """Request the lectura of ``provider_id`` together with the others.
+
+        Lecturas of the providers pulled in the same transaction that share
+        credentials, import type and dates are sent as a single request
+        listing all their accounts, from a job queued when the transaction
+        commits.
+        """
+        precommit = self.env.cr.precommit
+        batches = precommit.data.get("bankinplay.lectura")
+        if batches is None:
+            batches = precommit.data["bankinplay.lectura"] = {}
+            precommit.add(
+                functools.partial(self._enqueue_lectura_batches, batches))
+        key = (
+            provider_id.username,
+            provider_id.password,
+            "card" if provider_id.bankinplay_is_card
+            else provider_id.bankinplay_import_type,
+            date_since,
+            date_until,
+        )
+        batches.setdefault(key, []).append(provider_id.id)
+
+    def _enqueue_lectura_batches(self, batches):
+        for key, provider_ids in batches.items():
+            import_type, date_since, date_until = key[2:]
+            self.with_delay(
+                channel="root.bankinplay",
+                identity_key="bankinplay-lectura-%s-%s-%s-%s" % (
+                    import_type, date_since, date_until,
+                    ",".join(str(provider_id) for provider_id in provider_ids)),
+                description=_("[BANKINPLAY] - Lectura %s") % import_type,
+            )._send_lectura_batch(
+                provider_ids, import_type, date_since, date_until)
+        batches.clear()
+        # Precommit hooks run after the transaction is flushed.
+        self.env["base"].flush()
+
+    def _send_lectura_batch(self, provider_ids, import_type, date_since,
+                            date_until):
+        """Send the coalesced lectura of ``provider_ids``.
+
+        Providers without account number read every account of their
+        credentials, as a lectura listing no account does, so they are
+        still sent on their own.
+        """
+        providers = self.env["online.bank.statement.provider"].browse(
+            provider_ids).exists()
+        if not providers:
+            return False
+        try:
+            access_data = self._login(
+                providers[0].username, providers[0].password)
+            if import_type == "card":
+                self._send_card_batch(
+                    access_data, providers, date_since, date_until)
+                return True
+            for provider in providers.filtered(lambda x: not x.account_number):
+                self._send_lectura(
+                    dict(access_data), import_type, date_since, date_until,
+                    provider)
+            providers = providers.filtered("account_number")
+            if not providers:
+                return True
+            accounts = []
+            by_account = {}
+            for provider in providers:
+                self._set_access_account(access_data, provider.account_number)
+                accounts.append(access_data.pop("bankinplay_account"))
+                by_account[sanitize_account_number(
+                    provider.account_number)] = provider.id
+            access_data["bankinplay_accounts"] = accounts
+            self._send_lectura(
+                access_data, import_type, date_since, date_until, providers,
+                by_account)
+        except UserError as e:
+            _logger.error(
+                "BankInPlay lectura of providers %s failed: %s",
+                providers.ids, e)
+            self.env["bankinplay.log"]._log({
+                "operation_type": "error",
+                "status": "error",
+                "notes": str(e)[:255],
+                "triggered_event": "lectura",
+            })
+            raise
+        return True
+
+    def _send_lectura(self, access_data, import_type, date_since, date_until,
+                      providers, by_account=None):
+        if import_type == "intraday":
+            self._get_transactions(
+                access_data, date_since, date_until, providers, by_account)
+        else:
+            self._get_closing_transactions(
+                access_data, date_since, date_until, providers, by_account)
+
+    def _send_card_batch(self, access_data, providers, date_since, date_until):
+        """Send one card lectura per BankInPlay sociedad of ``providers``.
+
+        Providers without card number read every sociedad, so they are
+        still sent on their own.
+        """
+        for provider in providers.filtered(
+                lambda x: not x.bankinplay_card_number):
+            self._get_card_transactions(
+                dict(access_data), date_since, date_until, provider)
+        cards_by_company = {}
+        for provider in providers.filtered("bankinplay_card_number"):
+            self._set_access_card(access_data, provider.bankinplay_card_number)
+            company_card = access_data.pop("bankinplay_company_card")
+            cards_by_company.setdefault(company_card, {})[
+                provider.bankinplay_card_number] = provider.id
+        for company_card, cards in cards_by_company.items():
+            access_data["bankinplay_company_card"] = company_card
+            self._get_card_transactions(
+                access_data, date_since, date_until,
+                providers.browse(list(cards.values())), cards)
+
+    def _get_closing_transactions(self, access_data, date_since, date_until, provider_id,
+                                  providers=None):
         """Get closing transactions from bankingplay."""
         url = BANKINPLAY_ENDPOINT_V1 + "/statement/lectura_cierre"
 
@@ -381,7 +796,7 @@ class BankinPlayInterface(models.AbstractModel):
             "deshabilitar_callback": False,
             "fechaDesdeOperacion": date_since.strftime("%d/%m/%Y"),
             "fechaHastaOperacion": date_until.strftime("%d/%m/%Y"),
-            "cuentasBancarias": [access_data.get("bankinplay_account")] if access_data.get("bankinplay_account", False) else []
+            "cuentasBancarias": self._get_lectura_accounts(access_data),
         }
 
         data = self._simple_post_request(access_data, url, params)
@@ -390,9 +805,11 @@ class BankinPlayInterface(models.AbstractModel):
             "event": "lectura_cierre",
             "date_since": date_since.strftime("%Y/%m/%d"),
             "date_until": date_until.strftime("%Y/%m/%d"),
-            "provider_id": provider_id.id,
+            "provider_id": provider_id[:1].id,
             "access_data": access_data
         }
+        if providers:
+            event_data["providers"] = providers
 
         log_entry = self.env['bankinplay.log'].create({
             'operation_type': 'request',
@@ -406,7 +823,8 @@ class BankinPlayInterface(models.AbstractModel):
             'triggered_event': 'lectura_cierre'
         })
 
-    def _get_card_transactions(self, access_data, date_since, date_until, provider_id):
+    def _get_card_transactions(self, access_data, date_since, date_until, provider_id,
+                               cards=None):
         """Get transactions from bankingplay, using last_identifier as pointer.
 
         Note that Ponto has the transactions in descending order. The first
@@ -430,9 +848,11 @@ class BankinPlayInterface(models.AbstractModel):
             "event": "lectura_tarjeta",
             "date_since": date_since.strftime("%Y/%m/%d"),
             "date_until": date_until.strftime("%Y/%m/%d"),
-            "provider_id": provider_id.id,
+            "provider_id": provider_id[:1].id,
             "access_data": access_data
         }
+        if cards:
+            event_data["cards"] = cards
 
         log_entry = self.env['bankinplay.log'].create({
             'operation_type': 'request',
@@ -468,30 +888,78 @@ class BankinPlayInterface(models.AbstractModel):
         statement_date_until = datetime.strptime(
             event_data.get("date_until"), "%Y/%m/%d")
 
-        provider_id._create_or_update_statement(
+        self._run_callback_step(
+            "provider-%s" % provider_id.id,
+            provider_id._create_or_update_statement,
             (new_transactions, {}), statement_date_since, statement_date_until
         )
 
         return True
 
+    def _get_transaction_account(self, transaction):
+        """IBAN of the bank account a BankInPlay movement belongs to."""
+        account = transaction.get(BANKINPLAY_MOVEMENT_ACCOUNT_FIELD)
+        return sanitize_account_number(account) if account else False
+
+    def _split_transactions_by_provider(self, transactions, event_data):
+        """Fan the movements of a coalesced lectura out to their providers.
+
+        Card movements are split by card number, account movements by the
+        IBAN of their account. An account movement that belongs to none of
+        the providers of the lectura makes it fail, so that it can be
+        processed again from the inbox.
+        """
+        providers = event_data.get("providers") or {}
+        cards = event_data.get("cards") or {}
+        if not providers and not cards:
+            return {event_data.get("provider_id"): transactions}
+        provider_ids = set(providers.values()) | set(cards.values())
+        result = {provider_id: [] for provider_id in provider_ids}
+        for transaction in transactions:
+            if cards:
+                # Lecturas of a sociedad also list its other cards.
+                provider_id = cards.get(transaction.get("num_tarjeta"), False)
+                if provider_id:
+                    result[provider_id].append(transaction)
+                continue
+            provider_id = providers.get(
+                self._get_transaction_account(transaction), False)
+            if not provider_id and len(provider_ids) == 1:
+                provider_id = next(iter(provider_ids))
+            if not provider_id:
+                raise UserError(
+                    _("BankInPlay : no provider found for movement %s")
+                    % transaction.get("id"))
+            result[provider_id].append(transaction)
+        return result
+
+    def manage_lectura_fanout(self, transactions, event_data):
+        """Build the statement of every provider the lectura was made for."""
+        transactions_by_provider = self._split_transactions_by_provider(
+            transactions, event_data)
+        for provider_id, provider_transactions in transactions_by_provider.items():
+            self.manage_lectura_callback(
+                provider_transactions, dict(event_data, provider_id=provider_id))
+        return True
+
     def manage_lectura_cierre_callback(self, data, event_data):
         """Manage the callback for intraday transactions."""
         transactions = self._get_transactions_from_data(data, event_data)
-        self.manage_lectura_callback(transactions, event_data)
+        self.manage_lectura_fanout(transactions, event_data)
 
         return True
 
     def manage_lectura_intradia_callback(self, data, event_data):
         """Manage the callback for intraday transactions."""
         transactions = self._get_transactions_from_data(data, event_data)
-        self.manage_lectura_callback(transactions, event_data)
+        self.manage_lectura_fanout(transactions, event_data)
 
         return True
 
     def manage_lectura_tarjeta_callback(self, data, event_data):
         """Manage the callback for intraday transactions."""
         transactions = self._get_transactions_from_data(data, event_data)
-        self.manage_lectura_callback(transactions, event_data)
+        self.manage_lectura_fanout(transactions, event_data)
 
         return True
 
@@ -499,9 +967,11 @@ class BankinPlayInterface(models.AbstractModel):
         signature = data.get('signature')
         response_id = data.get('responseId')
 
-        request_id = self.env['bankinplay.log'].sudo().search(
-            [('response_id', '=', response_id),
-             ('signature', '=', signature)])
+        request_id = self.env['bankinplay.log'].sudo()._get_request_log(
+            response_id, signature)
+        if not request_id.event_data:
+            raise UserError(
+                _("BankInPlay : no request found for response %s") % response_id)
 
         event_data = json.loads(request_id.event_data)
         access_data = event_data.get('access_data')
@@ -520,4 +990,66 @@ class BankinPlayInterface(models.AbstractModel):
             'signature': signature,
         })
 
-        return log_entry, desencrypt_data, request_id
\ No newline at end of file
+        return log_entry, desencrypt_data, request_id
+
+    def _process_in_batches(self, items, func):
+        """Run ``func(value)`` for each ``(key, value)`` of ``items``.
+
+        Items are isolated with savepoints and committed in batches on the
+        async request whose continuation is running, see
+        ``bankinplay.async.request._process_items``. Returns the failed
+        items with their error.
+        """
+        request = self.env["bankinplay.async.request"].sudo().browse(
+            self.env.context.get("bankinplay_async_request_id"))
+        return request._process_items(list(items), func)
+
+    def _run_callback_step(self, key, func, *args):
+        """Run a step of the callback being processed only once.
+
+        Steps of a callback processed from the inbox are committed one by
+        one, so a callback processed again resumes after the last one.
+        """
+        callback = self.env["bankinplay.callback"].browse(
+            self.env.context.get("bankinplay_callback_id"))
+        if not callback:
+            return func(*args)
+        return callback._run_step(key, func, *args)
+
+    def manage_callback(self, event, data):
+        """Process a received ``event`` callback (lectura_cierre, ...)."""
+        request_id = self.env['bankinplay.log'].sudo()._get_request_log(
+            data.get('responseId'), data.get('signature'))
+        if request_id.status == 'success':
+            # Already fully processed, BankInPlay is retrying the callback.
+            return True
+
+        log_entry, desencrypt_data, request_id = self.manage_generic_callback(
+            data)
+        event_data = json.loads(request_id.event_data)
+
+        if desencrypt_data.get('results') and len(desencrypt_data.get('results')) == 0:
+            request_id.write({
+                'status': 'error',
+                'related_log_id': log_entry.id,
+            })
+            log_entry.write({
+                'status': 'error',
+                'related_log_id': request_id.id,
+            })
+            return False
+
+        response = getattr(self, "manage_%s_callback" % event)(
+            desencrypt_data, event_data
+        )
+
+        if response:
+            request_id.write({
+                'status': 'success',
+                'related_log_id': log_entry.id,
+            })
+            log_entry.write({
+                'status': 'success',
+                'related_log_id': request_id.id,
+            })
+        return response
@@ -1,5 +1,35 @@
-from odoo import models, fields, api
-from datetime import datetime
+import functools
+import logging
+from datetime import datetime, timedelta
+
+from odoo import SUPERUSER_ID, models, fields, api, tools
+from odoo.osv import expression
+
+_logger = logging.getLogger(__name__)
+
+LOG_PURGE_BATCH = 5000
+LOG_LEVELS = ('off', 'error', 'metadata', 'full')
+
+PAYLOAD_FIELDS = {
+    'request_data': 'request_payload_id',
+    'response_data': 'response_payload_id',
+    'desencrypt_data': 'desencrypt_payload_id',
+    'event_data': 'event_payload_id',
+}
+
+
+def _flush_log_entries(registry, entries):
+    """Write buffered log entries through their own cursor."""
+    if not entries:
+        return
+    vals_list = list(entries)
+    del entries[:]
+    try:
+        with registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            env['bankinplay.log'].create(vals_list)
+    except Exception:
+        _logger.exception("BankInPlay logs could not be written")
 
 
 class BankinplayLog(models.Model):
@@ -13,7 +43,7 @@ class BankinplayLog(models.Model):
         ('error', 'Error'),
     ], string='Operation Type', required=True)
 
-    response_id = fields.Char(string='Response ID')
+    response_id = fields.Char(string='Response ID', index=True)
 
     signature = fields.Char(string='Signature')
 
@@ -22,20 +52,266 @@ class BankinplayLog(models.Model):
 
     date_time = fields.Datetime(
         string='Datetime', default=lambda self: fields.Datetime.now(), readonly=True)
-    request_data = fields.Text(string='Request Data')
-    response_data = fields.Text(string='Response Data')
-    desencrypt_data = fields.Text(string='Desencrypt Data')
-    event_data = fields.Text(string='Event Data')
+    # Payloads are stored compressed and deduplicated, they are only
+    # decompressed when read.
+    request_data = fields.Text(
+        string='Request Data', compute='_compute_payload_data', readonly=True)
+    response_data = fields.Text(
+        string='Response Data', compute='_compute_payload_data', readonly=True)
+    desencrypt_data = fields.Text(
+        string='Desencrypt Data', compute='_compute_payload_data', readonly=True)
+    event_data = fields.Text(
+        string='Event Data', compute='_compute_payload_data', readonly=True)
+    request_payload_id = fields.Many2one(
+        'bankinplay.log.payload', string='Request Payload', readonly=True,
+        index=True)
+    response_payload_id = fields.Many2one(
+        'bankinplay.log.payload', string='Response Payload', readonly=True,
+        index=True)
+    desencrypt_payload_id = fields.Many2one(
+        'bankinplay.log.payload', string='Desencrypt Payload', readonly=True,
+        index=True)
+    event_payload_id = fields.Many2one(
+        'bankinplay.log.payload', string='Event Payload', readonly=True,
+        index=True)
     status = fields.Selection([
         ('success', 'Success'),
         ('error', 'Error'),
         ('pending', 'Pending'),
-    ], string='Status', default='pending')
+    ], string='Status', default='pending', index=True)
 
     notes = fields.Char(string='Notes')
-    triggered_event = fields.Char(string='Triggered Event')
-    company_id = fields.Many2one('res.company', string='Company')
+    triggered_event = fields.Char(string='Triggered Event', index=True)
+    company_id = fields.Many2one('res.company', string='Company', index=True)
+
+    @api.depends(*PAYLOAD_FIELDS.values())
+    def _compute_payload_data(self):
+        for log in self:
+            for field, payload_field in PAYLOAD_FIELDS.items():
+                payload = log[payload_field]
+                log[field] = payload.sudo()._get_text() if payload else False
+
+    @api.model
+    def _store_payloads(self, vals):
+        """Replace payload texts in ``vals`` by their stored payloads."""
+        payload_model = self.env['bankinplay.log.payload'].sudo()
+        for field, payload_field in PAYLOAD_FIELDS.items():
+            if field in vals:
+                vals[payload_field] = payload_model._get_or_create(
+                    vals.pop(field)).id
+        return vals
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        return super().create([self._store_payloads(dict(vals))
+                               for vals in vals_list])
+
+    def write(self, vals):
+        return super().write(self._store_payloads(dict(vals)))
+
+    def init(self):
+        tools.create_index(
+            self._cr, 'bankinplay_log_correlation_idx', self._table,
+            ['response_id', 'signature'])
+        self._cr.execute("""
+            CREATE INDEX IF NOT EXISTS bankinplay_log_pending_idx
+            ON bankinplay_log (triggered_event, date_time)
+            WHERE status = 'pending'
+        """)
+
+    @api.model
+    def _get_log_level(self):
+        level = self.env['ir.config_parameter'].sudo().get_param(
+            'bankinplay.log_level', 'full')
+        return level if level in LOG_LEVELS else 'full'
+
+    @api.model
+    def _log(self, vals):
+        """Record a diagnostic entry according to ``bankinplay.log_level``.
+
+        Levels are ``off``, ``error`` (errors only), ``metadata`` (without
+        payloads) and ``full``. Entries are buffered and written in batch
+        through a separate cursor once the current transaction commits or
+        rolls back, so they are kept even when it is rolled back. They are
+        never written while it is running, as it may hold locks the
+        separate cursor would wait for.
+        """
+        level = self._get_log_level()
+        is_error = vals.get('status') == 'error' \
+            or vals.get('operation_type') == 'error'
+        if level == 'off' or (level == 'error' and not is_error):
+            return False
+        vals = dict(vals)
+        if level == 'metadata':
+            for field in PAYLOAD_FIELDS:
+                vals.pop(field, None)
+        vals.setdefault('company_id', self.env.company.id)
+        vals.setdefault('date_time', fields.Datetime.now())
+        self._get_log_buffer().append(vals)
+        return True
+
+    @api.model
+    def _get_log_buffer(self):
+        cr = self.env.cr
+        buffer = cr.postcommit.data.get('bankinplay.log')
+        if buffer is None:
+            buffer = cr.postcommit.data['bankinplay.log'] = []
+            flush = functools.partial(_flush_log_entries, self.pool, buffer)
+            cr.postcommit.add(flush)
+            cr.postrollback.add(flush)
+        return buffer
+
+    @api.model
+    def _get_request_log(self, response_id, signature):
+        """Return the request a BankInPlay callback answers to."""
+        if not response_id:
+            return self.browse()
+        return self.search([
+            ('operation_type', '=', 'request'),
+            ('response_id', '=', response_id),
+            ('signature', '=', signature),
+        ], order='id desc', limit=1)
 
     def set_status(self, status):
         self.ensure_one()
         self.status = status
+
+    @api.model
+    def _cron_purge(self):
+        """Roll up and delete the logs older than their retention.
+
+        Logs are deleted in bounded chunks, each one committed on its own,
+        to avoid long locks on the table.
+        """
+        batch_size = int(self.env['ir.config_parameter'].sudo().get_param(
+            'bankinplay.log_purge_batch', LOG_PURGE_BATCH))
+        summary_model = self.env['bankinplay.log.summary']
+        for rule in self.env['bankinplay.log.retention'].search([]):
+            domain = rule._get_log_domain()
+            while True:
+                logs = self.search(domain, order='id', limit=batch_size)
+                if not logs:
+                    break
+                summary_model._rollup(logs)
+                logs.unlink()
+                self.env.cr.commit()
+                _logger.info(
+                    "BankInPlay logs purged: %s (%s)", len(logs), rule.name)
+        self.env['bankinplay.log.payload']._gc_payloads(batch_size)
+
+
+class BankinplayLogRetention(models.Model):
+    _name = 'bankinplay.log.retention'
+    _description = 'Log Bankinplay Retention'
+    _order = 'sequence, id'
+
+    name = fields.Char(string='Name', required=True)
+    sequence = fields.Integer(string='Sequence', default=10)
+    active = fields.Boolean(string='Active', default=True)
+    operation_type = fields.Selection([
+        ('request', 'Request'),
+        ('response', 'Response'),
+        ('error', 'Error'),
+    ], string='Operation Type', help='Leave empty to apply to all types.')
+    status = fields.Selection([
+        ('success', 'Success'),
+        ('error', 'Error'),
+        ('pending', 'Pending'),
+    ], string='Status', help='Leave empty to apply to all statuses.')
+    days = fields.Integer(
+        string='Retention (days)', required=True, default=30,
+        help='Logs matched by several rules are kept for the longest '
+        'retention among them.')
+
+    def _get_log_match_domain(self):
+        self.ensure_one()
+        domain = []
+        if self.operation_type:
+            domain.append(('operation_type', '=', self.operation_type))
+        if self.status:
+            domain.append(('status', '=', self.status))
+        return domain
+
+    def _get_log_domain(self):
+        """Logs purged by this rule.
+
+        Logs also matched by a rule with a longer retention are left to
+        that rule, so the longest matching retention wins.
+        """
+        self.ensure_one()
+        domain = expression.AND([
+            [('date_time', '<',
+              fields.Datetime.now() - timedelta(days=self.days))],
+            self._get_log_match_domain(),
+        ])
+        longer_rules = self.search([('days', '>', self.days)])
+        if longer_rules:
+            domain = expression.AND([domain, ['!'] + expression.OR([
+                rule._get_log_match_domain() for rule in longer_rules])])
+        return domain
+
+
+class BankinplayLogSummary(models.Model):
+    _name = 'bankinplay.log.summary'
+    _description = 'Log Bankinplay Daily Summary'
+    _order = 'date desc'
+
+    date = fields.Date(string='Date', required=True, readonly=True)
+    company_id = fields.Many2one(
+        'res.company', string='Company', readonly=True)
+    triggered_event = fields.Char(string='Triggered Event', readonly=True)
+    operation_type = fields.Char(string='Operation Type', readonly=True)
+    status = fields.Char(string='Status', readonly=True)
+    log_count = fields.Integer(
+        string='Logs', readonly=True, group_operator='sum')
+    error_count = fields.Integer(
+        string='Errors', readonly=True, group_operator='sum')
+    # Float, daily payload sizes overflow an integer column.
+    payload_bytes = fields.Float(
+        string='Payload Bytes', readonly=True, group_operator='sum')
+
+    def init(self):
+        self._cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS bankinplay_log_summary_key_idx
+            ON bankinplay_log_summary (
+                date, COALESCE(company_id, 0), COALESCE(triggered_event, ''),
+                COALESCE(operation_type, ''), COALESCE(status, ''))
+        """)
+
+    @api.model
+    def _rollup(self, logs):
+        """Add ``logs`` to the daily counters of their company and event."""
+        self.flush()
+        logs.flush()
+        self._cr.execute("""
+            INSERT INTO bankinplay_log_summary (
+                date, company_id, triggered_event, operation_type, status,
+                log_count, error_count, payload_bytes,
+                create_uid, create_date, write_uid, write_date)
+            SELECT l.date_time::date, l.company_id, l.triggered_event,
+                   l.operation_type, l.status,
+                   count(*),
+                   count(*) FILTER (
+                       WHERE l.status = 'error' OR l.operation_type = 'error'),
+                   COALESCE(sum(
+                       COALESCE(rq.size, 0) + COALESCE(rs.size, 0)
+                       + COALESCE(de.size, 0) + COALESCE(ev.size, 0)), 0),
+                   %(uid)s, now() at time zone 'UTC',
+                   %(uid)s, now() at time zone 'UTC'
+            FROM bankinplay_log l
+            LEFT JOIN bankinplay_log_payload rq ON rq.id = l.request_payload_id
+            LEFT JOIN bankinplay_log_payload rs ON rs.id = l.response_payload_id
+            LEFT JOIN bankinplay_log_payload de ON de.id = l.desencrypt_payload_id
+            LEFT JOIN bankinplay_log_payload ev ON ev.id = l.event_payload_id
+            WHERE l.id IN %(ids)s
+            GROUP BY 1, 2, 3, 4, 5
+            ON CONFLICT (
+                date, COALESCE(company_id, 0), COALESCE(triggered_event, ''),
+                COALESCE(operation_type, ''), COALESCE(status, ''))
+            DO UPDATE SET
+                log_count = bankinplay_log_summary.log_count + EXCLUDED.log_count,
+                error_count = bankinplay_log_summary.error_count + EXCLUDED.error_count,
+                payload_bytes = bankinplay_log_summary.payload_bytes + EXCLUDED.payload_bytes,
+                write_date = EXCLUDED.write_date
+        """, {'uid': self.env.uid, 'ids': tuple(logs.ids)})
+        self.invalidate_cache()
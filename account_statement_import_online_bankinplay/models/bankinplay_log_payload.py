@@ -0,0 +1,112 @@
+import base64
+import hashlib
+import json
+import zlib
+
+from psycopg2 import IntegrityError
+
+from odoo import models, fields, api
+
+
+class BankinplayLogPayload(models.Model):
+    _name = 'bankinplay.log.payload'
+    _description = 'Log Bankinplay Payload'
+    _rec_name = 'checksum'
+
+    checksum = fields.Char(string='Checksum', required=True, index=True)
+    size = fields.Integer(string='Size')
+    compressed_size = fields.Integer(string='Compressed Size')
+    data_db = fields.Binary(string='Data', attachment=False)
+    data_file = fields.Binary(string='Data (filestore)', attachment=True)
+
+    _sql_constraints = [
+        ('checksum_uniq', 'unique(checksum)',
+         'A payload with the same content already exists.'),
+    ]
+
+    @api.model
+    def _get_or_create(self, text):
+        """Return the payload storing ``text``, content is stored once."""
+        if text is None or text is False or text == '':
+            return self.browse()
+        if not isinstance(text, str):
+            text = json.dumps(text)
+        raw = text.encode('utf-8')
+        checksum = hashlib.sha256(raw).hexdigest()
+        payload = self._find(checksum)
+        if payload:
+            return payload
+        compressed = zlib.compress(raw)
+        vals = {
+            'checksum': checksum,
+            'size': len(raw),
+            'compressed_size': len(compressed),
+        }
+        field = 'data_file' if self._use_filestore() else 'data_db'
+        vals[field] = base64.b64encode(compressed)
+        try:
+            with self.env.cr.savepoint():
+                return self.create(vals)
+        except IntegrityError:
+            # Stored meanwhile by a concurrent transaction.
+            return self._find(checksum)
+
+    @api.model
+    def _find(self, checksum):
+        """Return the payload with ``checksum``, locked against purges.
+
+        The lock is kept until the transaction ends, so the payload is not
+        purged before the log referring to it is committed.
+        """
+        self.env.cr.execute(
+            "SELECT id FROM bankinplay_log_payload WHERE checksum = %s "
+            "FOR KEY SHARE",
+            (checksum,),
+        )
+        row = self.env.cr.fetchone()
+        return self.browse(row[0] if row else [])
+
+    @api.model
+    def _use_filestore(self):
+        return self.env['ir.config_parameter'].sudo().get_param(
+            'bankinplay.log_payload_filestore', 'False') == 'True'
+
+    def _get_text(self):
+        self.ensure_one()
+        data = self.data_file or self.data_db
+        if not data:
+            return False
+        return zlib.decompress(base64.b64decode(data)).decode('utf-8')
+
+    @api.model
+    def _gc_payloads(self, batch_size):
+        """Delete the payloads no log refers to anymore.
+
+        Payloads are checked and deleted in a single statement, those
+        locked by a transaction logging them again are skipped.
+        """
+        while True:
+            self.env.cr.execute("""
+                DELETE FROM bankinplay_log_payload
+                WHERE id IN (
+                    SELECT p.id FROM bankinplay_log_payload p
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM bankinplay_log l
+                        WHERE l.request_payload_id = p.id
+                           OR l.response_payload_id = p.id
+                           OR l.desencrypt_payload_id = p.id
+                           OR l.event_payload_id = p.id)
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED)
+                RETURNING id
+            """, (batch_size,))
+            ids = [row[0] for row in self.env.cr.fetchall()]
+            if not ids:
+                break
+            self.env['ir.attachment'].sudo().search([
+                ('res_model', '=', self._name),
+                ('res_field', '=', 'data_file'),
+                ('res_id', 'in', ids),
+            ]).unlink()
+            self.invalidate_cache(ids=ids)
+            self.env.cr.commit()
@@ -6,6 +6,8 @@ from odoo.http import request
 
 _logger = logging.getLogger(__name__)
 
+CALLBACK_RESPONSE = {"status": "success", "message": "Datos recibidos correctamente"}
+
 
 class CallbackController(http.Controller):
 
@@ -15,125 +17,22 @@ class CallbackController(http.Controller):
         _logger.info("Callback estado: %s", kw)
         return {}
 
+    def _receive_callback(self, event):
+        """Store the callback in the inbox, it is processed by a job."""
+        payload = request.httprequest.data.decode(
+            request.httprequest.charset or "utf-8")
+        request.env["bankinplay.callback"].sudo()._receive(
+            event, payload, json.loads(payload))
+        return CALLBACK_RESPONSE
+
     @http.route('/webhook/lectura_cierre', auth='public', methods=['POST'], type='json')
     def callback_lectura_cierre(self, **kw):
-        data = json.loads(
-            request.httprequest.data.decode(
-                request.httprequest.charset or "utf-8")
-        )
-        interface_model = request.env["bankinplay.interface"]
-        log_entry, desencrypt_data, request_id = interface_model.manage_generic_callback(
-            data)
-        
-        # Obtener los datos del cuerpo de la solicitud
-        event_data = json.loads(request_id.event_data)
-
-        if desencrypt_data.get('results') and len(desencrypt_data.get('results')) == 0:
-            request_id.write({
-                'status': 'error',
-                'related_log_id': log_entry.id,
-            })
-            log_entry.write({
-                'status': 'error',
-                'related_log_id': request_id.id,
-            })
-
-            return {"status": "success", "message": "Datos recibidos correctamente"}
-
-        response = interface_model.sudo().manage_lectura_cierre_callback(
-            desencrypt_data, event_data
-        )
-
-        if response:
-            request_id.write({
-                'status': 'success',
-                'related_log_id': log_entry.id,
-            })
-            log_entry.write({
-                'status': 'success',
-                'related_log_id': request_id.id,
-            })
-
-        return {"status": "success", "message": "Datos recibidos correctamente"}
+        return self._receive_callback("lectura_cierre")
 
     @http.route('/webhook/lectura_intradia', auth='public', methods=['POST'], type='json')
     def callback_lectura_intradia(self, **kw):
-        data = json.loads(
-            request.httprequest.data.decode(
-                request.httprequest.charset or "utf-8")
-        )
-        interface_model = request.env["bankinplay.interface"]
-        log_entry, desencrypt_data, request_id = interface_model.manage_generic_callback(
-            data)
-        # Obtener los datos del cuerpo de la solicitud
-        event_data = json.loads(request_id.event_data)
-
-        if desencrypt_data.get('results') and len(desencrypt_data.get('results')) == 0:
-            request_id.write({
-                'status': 'error',
-                'related_log_id': log_entry.id,
-            })
-            log_entry.write({
-                'status': 'error',
-                'related_log_id': request_id.id,
-            })
-
-            return {"status": "success", "message": "Datos recibidos correctamente"}
-
-        response = interface_model.sudo().manage_lectura_intradia_callback(
-            desencrypt_data, event_data
-        )
-
-        if response:
-            request_id.write({
-                'status': 'success',
-                'related_log_id': log_entry.id,
-            })
-            log_entry.write({
-                'status': 'success',
-                'related_log_id': request_id.id,
-            })
-
-        # Responder al cliente
-        return {"status": "success", "message": "Datos recibidos correctamente"}
+        return self._receive_callback("lectura_intradia")
 
     @http.route('/webhook/lectura_tarjeta', auth='public', methods=['POST'], type='json')
     def callback_lectura_tarjeta(self, **kw):
-        data = json.loads(
-            request.httprequest.data.decode(
-                request.httprequest.charset or "utf-8")
-        )
-        interface_model = request.env["bankinplay.interface"]
-        log_entry, desencrypt_data, request_id = interface_model.manage_generic_callback(
-            data)
-        # Obtener los datos del cuerpo de la solicitud
-        event_data = json.loads(request_id.event_data)
-
-        if desencrypt_data.get('results') and len(desencrypt_data.get('results')) == 0:
-            request_id.write({
-                'status': 'error',
-                'related_log_id': log_entry.id,
-            })
-            log_entry.write({
-                'status': 'error',
-                'related_log_id': request_id.id,
-            })
-
-            return {"status": "success", "message": "Datos recibidos correctamente"}
-
-        response = interface_model.sudo().manage_lectura_tarjeta_callback(
-            desencrypt_data, event_data
-        )
-
-        if response:
-            request_id.write({
-                'status': 'success',
-                'related_log_id': log_entry.id,
-            })
-            log_entry.write({
-                'status': 'success',
-                'related_log_id': request_id.id,
-            })
-
-        # Responder al cliente
-        return {"status": "success", "message": "Datos recibidos correctamente"}
\ No newline at end of file
+        return self._receive_callback("lectura_tarjeta")
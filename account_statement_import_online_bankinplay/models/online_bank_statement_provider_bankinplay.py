@@ -46,6 +46,13 @@ class OnlineBankStatementProviderBankInPlay(models.Model):
         string='Número de tarjeta',
     )
 
+    bankinplay_batch_pull = fields.Boolean(
+        string="Batch BankInPlay requests",
+        help="Request the movements of every BankInPlay provider pulled at "
+        "the same time with the same credentials, import type and dates in "
+        "a single request.",
+    )
+
     @api.model
     def _get_available_services(self):
         """Each provider model must register its service."""
@@ -78,6 +85,9 @@ class OnlineBankStatementProviderBankInPlay(models.Model):
 
     def _bankinplay_retrieve_data(self, date_since, date_until):
         interface_model = self.env["bankinplay.interface"]
+        if self.bankinplay_batch_pull:
+            interface_model._queue_lectura(self, date_since, date_until)
+            return
         access_data = interface_model._login(self.username, self.password)
 
         if self.bankinplay_is_card:
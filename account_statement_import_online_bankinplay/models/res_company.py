@@ -53,15 +53,15 @@ class ResCompany(models.Model):
         access_data = self.check_bankinplay_connection()
 
         interface_model = self.env["bankinplay.interface"]
-        check_company = False
-        get_companies = interface_model._get_companies(access_data)
-        for company in get_companies:
-            if company['nif'] == self.vat.replace('ES', ''):
-                check_company = True
-                self.bankinplay_company_id = company['id']
-                break
-
-        if not check_company:
+        # Only the data of these credentials is read again, the other
+        # workers keep theirs until refreshed explicitly.
+        interface_model._invalidate_reference_cache(
+            access_data, list(interface_model._get_reference_urls()))
+        company = interface_model._get_reference_index(
+            access_data, "companies").get(self.vat.replace('ES', ''))
+        if company:
+            self.bankinplay_company_id = company['id']
+        else:
             raise UserError(
                 _("The company NIF does not match any of the companies in BankInPlay."))
 
@@ -76,3 +76,7 @@ class ResCompany(models.Model):
                 'sticky': False,
             }
         }
+
+    def bankinplay_refresh_reference_data(self):
+        """Drop the cached BankInPlay accounts, cards, companies and plans."""
+        self.env["bankinplay.interface"]._invalidate_reference_cache()
@@ -0,0 +1,4 @@
+from . import test_bankinplay_callback
+from . import test_bankinplay_log
+from . import test_bankinplay_async_request
+from . import test_bankinplay_reference_cache
@@ -0,0 +1,134 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+import json
+from unittest import mock
+
+from odoo import fields
+from odoo.tests.common import TransactionCase
+
+from ..models.bankinplay_async_request import _merge_args, _merge_results
+
+
+class TestBankinplayAsyncRequest(TransactionCase):
+    def setUp(self):
+        super().setUp()
+        self.request_model = self.env["bankinplay.async.request"]
+        request_class = type(self.request_model)
+        patcher = mock.patch.object(
+            request_class, "_get_access_data", return_value={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(
+            type(self.env["bankinplay.interface"]), "_test_continuation",
+            create=True)
+        self.continuation = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _create_request(self, state, result=None, **continuation_args):
+        return self.request_model.create({
+            "response_id": "resp-%s" % state,
+            "state": state,
+            "company_id": self.env.company.id,
+            "continuation": "_test_continuation",
+            "batch_key": "batch-1",
+            "result_data": json.dumps(result or {}),
+            "continuation_args": json.dumps(continuation_args),
+        })
+
+    def test_merge_results(self):
+        self.assertEqual(_merge_results([]), {})
+        self.assertEqual(
+            _merge_results([
+                {"results": {"items": [1, 2]}, "status": "ok"},
+                {"results": {"items": [3]}, "status": "ko"},
+            ]),
+            {"results": {"items": [1, 2, 3]}, "status": "ok"},
+        )
+
+    def test_merge_args(self):
+        self.assertEqual(
+            _merge_args([
+                {"sync_date": "2024-01-01", "hashes": {"1": "a"}},
+                {"sync_date": "2024-01-01", "hashes": {"2": "b"}},
+                {"sync_date": "2024-01-01"},
+            ]),
+            {"sync_date": "2024-01-01", "hashes": {"1": "a", "2": "b"}},
+        )
+
+    def test_batch_waits_for_pending_requests(self):
+        first = self._create_request("processed", {"items": [1]}, hashes={"1": "a"})
+        second = self._create_request("pending")
+        self.assertFalse(first._run_continuation())
+        self.continuation.assert_not_called()
+        second.write({
+            "state": "processed",
+            "result_data": json.dumps({"items": [2]}),
+            "continuation_args": json.dumps({"hashes": {"2": "b"}}),
+        })
+        self.assertTrue(second._run_continuation())
+        self.continuation.assert_called_once_with(
+            {}, {"items": [1, 2]}, hashes={"1": "a", "2": "b"})
+        self.assertEqual((first | second).mapped("state"), ["done", "done"])
+
+    def test_batch_continuation_runs_once(self):
+        first = self._create_request("processed")
+        second = self._create_request("processed")
+        self.assertTrue(first._run_continuation())
+        self.assertFalse(second._run_continuation())
+        self.assertEqual(self.continuation.call_count, 1)
+
+    def test_failed_request_finishes_batch(self):
+        processed = self._create_request("processed")
+        failed = self._create_request("pending")
+        interface_class = type(self.env["bankinplay.interface"])
+        with mock.patch.object(
+            interface_class, "_get_async_status", return_value="erroneo"
+        ), mock.patch.object(
+            type(self.request_model), "_enqueue_continuation", autospec=True
+        ) as enqueue:
+            failed._poll()
+        self.assertEqual(failed.state, "error")
+        enqueue.assert_called_once_with(processed)
+        self.assertTrue(processed._run_continuation())
+        self.assertEqual(processed.state, "done")
+        self.assertEqual(failed.state, "error")
+
+    def test_poll_error_does_not_block_other_requests(self):
+        broken = self._create_request("pending")
+        other = self._create_request("pending")
+        (broken | other).write({
+            "batch_key": False,
+            "next_check": fields.Datetime.now(),
+        })
+        broken.response_id = "resp-broken"
+
+        def get_async_status(access_data, response_id, params=None):
+            if response_id == "resp-broken":
+                raise ValueError("Unexpected response")
+            return "pendiente"
+
+        with mock.patch.object(
+            type(self.env["bankinplay.interface"]), "_get_async_status",
+            side_effect=get_async_status,
+        ), mock.patch.object(self.env.cr, "commit"), mock.patch.object(
+            type(self.request_model), "_trigger_poll"
+        ):
+            self.request_model._cron_poll()
+        self.assertEqual(broken.state, "pending")
+        self.assertEqual(broken.attempts, 1)
+        self.assertEqual(broken.notes, "Unexpected response")
+        self.assertGreater(broken.next_check, fields.Datetime.now())
+        self.assertEqual(other.attempts, 1)
+        # Past its deadline the request is set in error.
+        broken.write({
+            "next_check": fields.Datetime.now(),
+            "deadline": fields.Datetime.now(),
+        })
+        with mock.patch.object(
+            type(self.env["bankinplay.interface"]), "_get_async_status",
+            side_effect=get_async_status,
+        ), mock.patch.object(self.env.cr, "commit"), mock.patch.object(
+            type(self.request_model), "_trigger_poll"
+        ):
+            self.request_model._cron_poll()
+        self.assertEqual(broken.state, "error")
+        self.assertEqual(broken.notes, "Unexpected response")
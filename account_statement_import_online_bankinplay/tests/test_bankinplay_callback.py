@@ -0,0 +1,70 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+import json
+from unittest import mock
+
+from odoo.tests.common import TransactionCase
+
+from odoo.addons.queue_job.exception import RetryableJobError
+
+
+class TestBankinplayCallback(TransactionCase):
+    def setUp(self):
+        super().setUp()
+        self.callback_model = self.env["bankinplay.callback"]
+        patcher = mock.patch.object(type(self.callback_model), "_enqueue")
+        self.enqueue = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(self.env.cr, "commit")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.data = {"responseId": "resp-1", "signature": "sig-1"}
+
+    def _receive(self):
+        return self.callback_model._receive(
+            "lectura_cierre", json.dumps(self.data), self.data)
+
+    def test_receive_deduplicates(self):
+        callback = self._receive()
+        self.assertEqual(self._receive(), callback)
+        self.assertEqual(
+            self.callback_model.search_count(
+                [("response_id", "=", "resp-1")]), 1)
+        self.assertEqual(self.enqueue.call_count, 1)
+
+    def test_receive_requeues_error(self):
+        callback = self._receive()
+        callback.state = "error"
+        self._receive()
+        self.assertEqual(callback.state, "received")
+        self.assertEqual(self.enqueue.call_count, 2)
+
+    def test_run_step_once(self):
+        callback = self._receive()
+        func = mock.Mock(return_value="result")
+        self.assertEqual(callback._run_step("step-1", func, 1), "result")
+        self.assertTrue(callback._run_step("step-1", func, 1))
+        func.assert_called_once_with(1)
+        self.assertEqual(json.loads(callback.progress), ["step-1"])
+
+    def test_process_unlogged_request_retries(self):
+        callback = self._receive()
+        self.assertFalse(callback.request_log_id)
+        with self.assertRaises(RetryableJobError):
+            callback._process()
+        self.assertEqual(callback.state, "received")
+
+    def test_process_resolves_late_request(self):
+        callback = self._receive()
+        request_log = self.env["bankinplay.log"].create({
+            "operation_type": "request",
+            "response_id": "resp-1",
+            "signature": "sig-1",
+        })
+        with mock.patch.object(
+            type(self.env["bankinplay.interface"]), "manage_callback"
+        ) as manage_callback:
+            self.assertTrue(callback._process())
+        manage_callback.assert_called_once_with(
+            "lectura_cierre", self.data)
+        self.assertEqual(callback.request_log_id, request_log)
+        self.assertEqual(callback.state, "done")
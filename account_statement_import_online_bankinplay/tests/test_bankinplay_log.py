@@ -0,0 +1,85 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+from datetime import timedelta
+from unittest import mock
+
+from odoo import fields
+from odoo.tests.common import TransactionCase
+
+
+class TestBankinplayLog(TransactionCase):
+    def setUp(self):
+        super().setUp()
+        self.log_model = self.env["bankinplay.log"]
+        self.retention_model = self.env["bankinplay.log.retention"]
+        patcher = mock.patch.object(self.env.cr, "commit")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _create_log(self, days, **vals):
+        return self.log_model.create(dict({
+            "operation_type": "response",
+            "status": "success",
+            "triggered_event": "test-retention",
+            "date_time": fields.Datetime.now() - timedelta(days=days),
+        }, **vals))
+
+    def test_log_level(self):
+        params = self.env["ir.config_parameter"].sudo()
+        buffer = self.log_model._get_log_buffer()
+        self.addCleanup(buffer.clear)
+        params.set_param("bankinplay.log_level", "off")
+        self.assertFalse(self.log_model._log(
+            {"operation_type": "error", "status": "error"}))
+        params.set_param("bankinplay.log_level", "error")
+        self.assertFalse(self.log_model._log(
+            {"operation_type": "request", "status": "success"}))
+        self.assertTrue(self.log_model._log(
+            {"operation_type": "error", "response_data": "boom"}))
+        params.set_param("bankinplay.log_level", "metadata")
+        self.assertTrue(self.log_model._log(
+            {"operation_type": "request", "request_data": "payload"}))
+        self.assertEqual(len(buffer), 2)
+        self.assertEqual(buffer[0]["response_data"], "boom")
+        self.assertNotIn("request_data", buffer[1])
+
+    def test_log_buffered_until_transaction_ends(self):
+        buffer = self.log_model._get_log_buffer()
+        self.addCleanup(buffer.clear)
+        count = self.log_model.search_count([])
+        for index in range(250):
+            self.log_model._log({
+                "operation_type": "request",
+                "request_data": "payload %s" % index,
+            })
+        self.assertEqual(len(buffer), 250)
+        self.assertEqual(self.log_model.search_count([]), count)
+        self.assertIs(self.log_model._get_log_buffer(), buffer)
+
+    def test_purge_longest_retention_wins(self):
+        self.retention_model.search([]).write({"active": False})
+        self.retention_model.create({
+            "name": "All", "sequence": 1, "days": 30})
+        self.retention_model.create({
+            "name": "Errors", "sequence": 2, "status": "error", "days": 180})
+        recent = self._create_log(10)
+        success = self._create_log(60)
+        error = self._create_log(60, status="error")
+        old_error = self._create_log(200, status="error")
+        self.log_model._cron_purge()
+        self.assertTrue(recent.exists())
+        self.assertFalse(success.exists())
+        self.assertTrue(error.exists())
+        self.assertFalse(old_error.exists())
+        summaries = self.env["bankinplay.log.summary"].search(
+            [("triggered_event", "=", "test-retention")])
+        self.assertEqual(sum(summaries.mapped("log_count")), 2)
+        self.assertEqual(sum(summaries.mapped("error_count")), 1)
+
+    def test_purge_payloads(self):
+        self.retention_model.search([]).write({"active": False})
+        self.retention_model.create({"name": "All", "days": 30})
+        log = self._create_log(60, response_data='{"purged": true}')
+        payload = log.response_payload_id
+        self.assertEqual(log.response_data, '{"purged": true}')
+        self.log_model._cron_purge()
+        self.assertFalse(payload.exists())
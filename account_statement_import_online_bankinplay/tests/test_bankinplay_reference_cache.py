@@ -0,0 +1,39 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+from unittest import mock
+
+from odoo.tests.common import TransactionCase
+
+
+class TestBankinplayReferenceCache(TransactionCase):
+    def setUp(self):
+        super().setUp()
+        self.company = self.env.company
+        self.company.vat = "ESA12345674"
+        self.params = self.env["ir.config_parameter"].sudo()
+        patcher = mock.patch.object(
+            type(self.company), "check_bankinplay_connection",
+            return_value={"user": "test-reference-cache"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(
+            type(self.env["bankinplay.interface"]), "_get_request",
+            return_value=[{"nif": "A12345674", "id": "7"}])
+        self.get_request = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _get_version(self):
+        return self.params.get_param("bankinplay.reference_cache_version", "0")
+
+    def test_connection_test_keeps_cache_version(self):
+        version = self._get_version()
+        self.company.test_bankinplay_connection()
+        self.company.test_bankinplay_connection()
+        self.assertEqual(self.company.bankinplay_company_id, "7")
+        # The companies are read again on every test, for these credentials.
+        self.assertEqual(self.get_request.call_count, 2)
+        self.assertEqual(self._get_version(), version)
+
+    def test_refresh_bumps_cache_version(self):
+        version = self._get_version()
+        self.company.bankinplay_refresh_reference_data()
+        self.assertEqual(self._get_version(), str(int(version) + 1))
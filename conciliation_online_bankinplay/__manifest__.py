@@ -4,16 +4,22 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 {
     "name": "Online Conciliation: BankInPlay",
-    "version": "15.0.3.0.3",
+    "version": "15.0.3.2.0",
     "category": "Account",
     "author": "Alquemy",
     "website": "https://www.alquemy.es",
     "license": "AGPL-3",
     "installable": True,
-    "depends": ["account_statement_import_online_bankinplay", "partner_manual_rank"],
+    "depends": [
+        "account_statement_import_online_bankinplay",
+        "account_payment_order",
+        "partner_manual_rank",
+    ],
     "data": [
+        "security/ir.model.access.csv",
         "data/cron.xml",
         "views/res_company.xml",
         "views/bank_statement.xml",
+        "views/bankinplay_document_outbox.xml",
     ],
 }
@@ -0,0 +1,29 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+import logging
+
+from odoo import tools
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """Fill the BankInPlay movement columns of existing statement lines.
+
+    Creating the columns beforehand keeps the ORM from recomputing them
+    line by line on update.
+    """
+    for column in ("bankinplay_movement_id", "bankinplay_account"):
+        if not tools.column_exists(cr, "account_bank_statement_line", column):
+            tools.create_column(
+                cr, "account_bank_statement_line", column, "varchar")
+    cr.execute(
+        """
+        UPDATE account_bank_statement_line
+        SET bankinplay_movement_id = substring(unique_import_id from '-([^-]*)$'),
+            bankinplay_account = substring(
+                unique_import_id from '^(.*)-[^-]*-[^-]*$')
+        WHERE unique_import_id LIKE '%-%'
+        """
+    )
+    _logger.info(
+        "BankInPlay movement filled on %s statement lines", cr.rowcount)
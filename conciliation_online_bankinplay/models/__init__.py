@@ -1,6 +1,10 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 from . import res_company
+from . import account_account
 from . import bankinplay_interface
 from . import account_move
+from . import account_payment_order
 from . import res_partner
-from . import bank_statement
\ No newline at end of file
+from . import bank_statement
+from . import bankinplay_document_outbox
+from . import bankinplay_analytic_code
@@ -0,0 +1,14 @@
+# 2024 Alquemy - José Antonio Fernández Valls <jafernandez@alquemy.es>
+# 2024 Alquemy - Javier de las Heras Gómez <jheras@alquemy.es>
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+from odoo import fields, models
+
+
+class AccountAccount(models.Model):
+    _inherit = "account.account"
+
+    bankinplay_fingerprint = fields.Char(
+        string="BankInPlay Fingerprint",
+        copy=False,
+        help="Fingerprint of the code and name last sent to BankInPlay.",
+    )
@@ -14,6 +14,10 @@ from odoo.exceptions import UserError
 
 _logger = logging.getLogger(__name__)
 
+# Fields of a journal item that change its BankInPlay document.
+BANKINPLAY_DOCUMENT_FIELDS = {"date_maturity", "ref", "partner_id"}
+
+
 class AccountMove(models.Model):
     _inherit = "account.move.line"
 
@@ -21,6 +25,32 @@ class AccountMove(models.Model):
         string="BankInPlay Sent",
         help="BankInPlay Sent.",
     )
+    bankinplay_hash = fields.Char(
+        string="BankInPlay Hash",
+        copy=False,
+        help="Hash of the document last sent to BankInPlay.",
+    )
+
+    def write(self, vals):
+        res = super().write(vals)
+        if BANKINPLAY_DOCUMENT_FIELDS.intersection(vals):
+            self.env["bankinplay.document.outbox"]._add_lines(self)
+        return res
+
+    def reconcile(self):
+        res = super().reconcile()
+        self.env["bankinplay.document.outbox"]._add_lines(self)
+        return res
+
+    def remove_move_reconcile(self):
+        lines = (
+            self
+            | self.matched_debit_ids.debit_move_id
+            | self.matched_credit_ids.credit_move_id
+        )
+        res = super().remove_move_reconcile()
+        self.env["bankinplay.document.outbox"]._add_lines(lines)
+        return res
 
 # class AccountMove(models.Model):
 #     _inherit = "account.move"
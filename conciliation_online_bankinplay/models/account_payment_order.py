@@ -0,0 +1,54 @@
+# 2024 Alquemy - José Antonio Fernández Valls <jafernandez@alquemy.es>
+# 2024 Alquemy - Javier de las Heras Gómez <jheras@alquemy.es>
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+from odoo import api, models
+
+# Fields of a payment order sent with the documents it remits.
+BANKINPLAY_PAYMENT_ORDER_FIELDS = {"name", "date_uploaded"}
+
+
+class AccountPayment(models.Model):
+    _inherit = "account.payment"
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        payments = super().create(vals_list)
+        # Documents enter their remittance with the payments of the order.
+        self.env["bankinplay.document.outbox"]._add_lines(
+            payments.payment_line_ids.move_line_id)
+        return payments
+
+    def unlink(self):
+        move_lines = self.payment_line_ids.move_line_id
+        res = super().unlink()
+        self.env["bankinplay.document.outbox"]._add_lines(move_lines.exists())
+        return res
+
+
+class AccountPaymentLine(models.Model):
+    _inherit = "account.payment.line"
+
+    def write(self, vals):
+        move_lines = self.move_line_id
+        res = super().write(vals)
+        if {"move_line_id", "payment_ids"}.intersection(vals):
+            self.env["bankinplay.document.outbox"]._add_lines(
+                move_lines | self.move_line_id)
+        return res
+
+    def unlink(self):
+        move_lines = self.move_line_id
+        res = super().unlink()
+        self.env["bankinplay.document.outbox"]._add_lines(move_lines.exists())
+        return res
+
+
+class AccountPaymentOrder(models.Model):
+    _inherit = "account.payment.order"
+
+    def write(self, vals):
+        res = super().write(vals)
+        if BANKINPLAY_PAYMENT_ORDER_FIELDS.intersection(vals):
+            self.env["bankinplay.document.outbox"]._add_lines(
+                self.payment_line_ids.move_line_id)
+        return res
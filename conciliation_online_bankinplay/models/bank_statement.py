@@ -1,4 +1,4 @@
-from odoo import _, fields, models
+from odoo import _, api, fields, models
 from odoo.exceptions import UserError
 from odoo.tools import float_is_zero
 
@@ -20,6 +20,32 @@ class BankStatementLine(models.Model):
         "to set the same number again if the line is cancelled,"
         "set to draft and re-processed again.",
     )
+    bankinplay_movement_id = fields.Char(
+        string='BankinPlay movement',
+        compute='_compute_bankinplay_movement',
+        store=True,
+        index=True,
+        help="BankinPlay movimiento_id parsed from the import identifier.",
+    )
+    bankinplay_account = fields.Char(
+        string='BankinPlay account',
+        compute='_compute_bankinplay_movement',
+        store=True,
+        index=True,
+    )
+
+    @api.depends('unique_import_id')
+    def _compute_bankinplay_movement(self):
+        # Imported lines are identified as <account>-<journal>-<movement>,
+        # or <journal>-<movement> for providers without an account number.
+        for line in self:
+            parts = (line.unique_import_id or '').rsplit('-', 2)
+            if len(parts) > 1:
+                line.bankinplay_account = parts[0] if len(parts) == 3 else False
+                line.bankinplay_movement_id = parts[-1]
+            else:
+                line.bankinplay_account = False
+                line.bankinplay_movement_id = False
 
     def process_reconciliation_oca(
         self, counterpart_aml_dicts=None, payment_aml_rec=None, new_aml_dicts=None
@@ -0,0 +1,26 @@
+# 2024 Alquemy - José Antonio Fernández Valls <jafernandez@alquemy.es>
+# 2024 Alquemy - Javier de las Heras Gómez <jheras@alquemy.es>
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+from odoo import fields, models
+
+
+class BankinplayAnalyticCode(models.Model):
+    _name = "bankinplay.analytic.code"
+    _description = "Analytic code registered in BankInPlay"
+
+    company_id = fields.Many2one("res.company", string="Company", index=True)
+    analytic_line_id = fields.Char(
+        string="Analytic Line ID", required=True, index=True,
+        help="BankInPlay analytic line the code is registered in.")
+    code = fields.Char(string="Code", required=True)
+    analytic_account_id = fields.Many2one(
+        "account.analytic.account", string="Analytic Account",
+        ondelete="cascade")
+
+    _sql_constraints = [
+        (
+            "line_code_uniq",
+            "unique(analytic_line_id, code)",
+            "The analytic code is already registered in BankInPlay.",
+        ),
+    ]
@@ -0,0 +1,118 @@
+# 2024 Alquemy - José Antonio Fernández Valls <jafernandez@alquemy.es>
+# 2024 Alquemy - Javier de las Heras Gómez <jheras@alquemy.es>
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+import logging
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+# Documents sent per BankInPlay request when draining the outbox.
+OUTBOX_BATCH_SIZE = 1000
+
+
+class BankinplayDocumentOutbox(models.Model):
+    _name = "bankinplay.document.outbox"
+    _description = "BankInPlay third-party documents to send again"
+    _order = "id"
+
+    move_line_id = fields.Many2one(
+        "account.move.line", string="Journal Item",
+        required=True, ondelete="cascade", index=True)
+    company_id = fields.Many2one(
+        "res.company", string="Company", required=True, index=True)
+    request_id = fields.Many2one(
+        "bankinplay.async.request", string="Request", ondelete="set null",
+        help="Request the document is being sent with, empty while it is "
+        "waiting to be sent.")
+
+    _sql_constraints = [
+        (
+            "move_line_uniq",
+            "unique(move_line_id)",
+            "The journal item is already waiting to be sent.",
+        ),
+    ]
+
+    @api.model
+    def _get_batch_size(self):
+        return int(self.env["ir.config_parameter"].sudo().get_param(
+            "bankinplay.outbox_batch_size", OUTBOX_BATCH_SIZE))
+
+    @api.model
+    def _add_lines(self, lines):
+        """Queue already sent documents of ``lines`` to be sent again.
+
+        Lines not sent yet are picked up by the export anyway. A document
+        changed again while being sent is queued once more.
+        """
+        lines = lines.filtered(
+            lambda x: x.bankinplay_sent
+            and x.company_id.bankinplay_enabled
+            and x.account_id.internal_type in ("payable", "receivable")
+        )
+        if not lines:
+            return
+        self.flush()
+        self.env.cr.execute("""
+            INSERT INTO bankinplay_document_outbox (
+                move_line_id, company_id,
+                create_uid, create_date, write_uid, write_date)
+            SELECT l.id, l.company_id,
+                   %(uid)s, now() at time zone 'UTC',
+                   %(uid)s, now() at time zone 'UTC'
+            FROM account_move_line l
+            WHERE l.id IN %(ids)s
+            ON CONFLICT (move_line_id) DO UPDATE
+            SET request_id = NULL, write_date = EXCLUDED.write_date
+        """, {"uid": self.env.uid, "ids": tuple(lines.ids)})
+        self.invalidate_cache()
+
+    @api.model
+    def _get_pending(self, company):
+        """Entries of ``company`` not being sent by a live request.
+
+        Entries are still linked to a finished request when its
+        continuation did not mark them as sent, or never ran, and are sent
+        again.
+        """
+        stale_date = fields.Datetime.now() - timedelta(
+            seconds=self.env["bankinplay.async.request"]._get_poll_config()[
+                "deadline"])
+        return self.search([
+            ("company_id", "=", company.id),
+            "|", "|",
+            ("request_id", "=", False),
+            ("request_id.state", "in", ["error", "timeout", "done"]),
+            "&",
+            ("request_id.state", "in", ["processed", "running"]),
+            ("request_id.write_date", "<", stale_date),
+        ])
+
+    @api.model
+    def _mark_sending(self, line_ids, request):
+        self.search([("move_line_id", "in", line_ids)]).write({
+            "request_id": request.id,
+        })
+
+    @api.model
+    def _mark_sent(self, sent_line_ids, failed_line_ids):
+        """Drop the entries sent, the failed ones wait for the next run."""
+        self.search([
+            ("move_line_id", "in", sent_line_ids),
+            ("request_id", "!=", False),
+        ]).unlink()
+        self.search([("move_line_id", "in", failed_line_ids)]).write({
+            "request_id": False,
+        })
+
+    @api.model
+    def _mark_unchanged(self, line_ids):
+        """Drop the entries of documents found unchanged since last sent.
+
+        Their content is compared in the current transaction, so they are
+        dropped even before being linked to a request, as when no contact
+        had to be exported before the documents.
+        """
+        self.search([("move_line_id", "in", line_ids)]).unlink()
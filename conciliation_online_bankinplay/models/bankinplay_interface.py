@@ -3,11 +3,10 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
 import base64
+import hashlib
 import json
 import logging
-import time
 
-import requests
 from dateutil.relativedelta import relativedelta
 
 from odoo import _, fields, models
@@ -31,22 +30,18 @@ class BankinPlayInterface(models.AbstractModel):
     _inherit = "bankinplay.interface"
     _description = "Interface to all interactions with Bankinplay API"
 
-    def _get_companies(self, access_data):
-        """Get companies from bankingplay."""
-        url = BANKINPLAY_ENDPOINT_V2 + "/entidad/sociedades"
+    def _get_reference_urls(self):
+        urls = super()._get_reference_urls()
+        urls["account_plans"] = BANKINPLAY_ENDPOINT_V1 + "/planes-contables"
+        return urls
 
-        data = self._get_request(access_data, url, {})
-        return data
+    def _get_reference_key(self, kind, item):
+        if kind == "account_plans":
+            return item.get("codigo")
+        return super()._get_reference_key(kind, item)
 
     # PLANES CONTABLES
 
-    def _get_account_plans(self, access_data):
-        """Get companies from bankingplay."""
-        url = BANKINPLAY_ENDPOINT_V1 + "/planes-contables"
-
-        data = self._get_request(access_data, url, {})
-        return data
-
     def _export_account_plan(self, access_data, start_date):
 
         url = BANKINPLAY_ENDPOINT_V1 + "/planContableApi/plan_contable"
@@ -57,55 +52,97 @@ class BankinPlayInterface(models.AbstractModel):
         account_plan = self.env['account.account'].search(
             [('company_id', '=', company_id.id)])
         code_size = len(account_plan[0].code)
-        accounts = []
-        for account in account_plan:
-            cuenta = {
-                "nombre": account.code,
-                "codigo": account.code,
-                "descripcion": account.name
-            }
-            accounts.append(cuenta)
 
-        params = {
-            "agrupaciones": [],
-            "planes": [{
-                "codigo": "PC" + company_id.vat.replace('ES', ''),
-                "nombre": "Plan contable - " + company_id.name,
-                "fechaInicio": date,
-                "pais": company_id.country_id.code,
-                "numeroDigitosCuentasContables": str(code_size),
-                "gestionarCCTerceros": "S" if company_id.bankinplay_manage_third_accounts else "N",
-                "cuentas": accounts
-                # "cuentas": []
-            }]
+        # Only new or renamed accounts are sent, unless the plan changed.
+        plan_fingerprint = self._get_fingerprint([
+            company_id.vat, company_id.name, company_id.country_id.code, date,
+            code_size, company_id.bankinplay_manage_third_accounts])
+        fingerprints = {
+            account.id: self._get_fingerprint([account.code, account.name])
+            for account in account_plan
         }
+        if plan_fingerprint == company_id.bankinplay_account_plan_fingerprint:
+            account_plan = account_plan.filtered(
+                lambda x: x.bankinplay_fingerprint != fingerprints[x.id])
+        if not account_plan:
+            _logger.info("BankInPlay account plan of %s unchanged", company_id.name)
+            return self.env['bankinplay.async.request']
+
+        def build(accounts):
+            # Every chunk sends the plan with part of its accounts.
+            params = {
+                "agrupaciones": [],
+                "planes": [{
+                    "codigo": "PC" + company_id.vat.replace('ES', ''),
+                    "nombre": "Plan contable - " + company_id.name,
+                    "fechaInicio": date,
+                    "pais": company_id.country_id.code,
+                    "numeroDigitosCuentasContables": str(code_size),
+                    "gestionarCCTerceros": "S" if company_id.bankinplay_manage_third_accounts else "N",
+                    "cuentas": [{
+                        "nombre": account.code,
+                        "codigo": account.code,
+                        "descripcion": account.name
+                    } for account in accounts]
+                    # "cuentas": []
+                }]
+            }
+            return params, {"fingerprints": {
+                str(account.id): fingerprints[account.id] for account in accounts
+            }}
+
+        return self._export_in_chunks(
+            access_data, url, account_plan, build,
+            "_export_account_plan_done", "plan_contable",
+            plan_fingerprint=plan_fingerprint)
 
-        data = self._get_pending_async_request(
-            access_data, self._post_request(access_data, url, {}, json.dumps(params)))
+    def _get_fingerprint(self, values):
+        return hashlib.sha1(json.dumps(values).encode()).hexdigest()
+
+    def _export_account_plan_done(self, access_data, data, fingerprints=None,
+                                  plan_fingerprint=False):
+        company_id = access_data.get('company_id', False)
         if data:
             if data.get('errors', False):
                 raise UserError("BANKINPLAY: \n" +
                                 data.get('errors')[0]['description'])
 
-            account_plan = False
-            account_plans = self._get_account_plans(access_data)
-            for plan in account_plans:
-                if plan['codigo'] == "PC" + company_id.vat.replace('ES', ''):
-                    account_plan = plan
+            plan_code = "PC" + company_id.vat.replace('ES', '')
+            account_plan = self._get_reference_index(
+                access_data, "account_plans").get(plan_code)
+            if not account_plan:
+                # The plan may just have been created by this export.
+                self._invalidate_reference_cache(
+                    access_data, ["account_plans"])
+                account_plan = self._get_reference_index(
+                    access_data, "account_plans").get(plan_code)
 
             if not account_plan:
                 raise UserError('No se ha podido generar el plan contable')
 
             self._set_company_account_plan(access_data, account_plan)
+            self._set_account_fingerprints(fingerprints or {})
+            company_id.bankinplay_account_plan_fingerprint = plan_fingerprint
 
         return data
 
+    def _set_account_fingerprints(self, fingerprints):
+        """Store the fingerprints of the accounts sent, in a single query."""
+        if not fingerprints:
+            return
+        self.env['account.account'].flush(['bankinplay_fingerprint'])
+        self.env.cr.execute("""
+            UPDATE account_account a
+            SET bankinplay_fingerprint = v.fingerprint
+            FROM unnest(%s, %s) AS v(id, fingerprint)
+            WHERE a.id = v.id
+        """, ([int(account_id) for account_id in fingerprints],
+              list(fingerprints.values())))
+        self.env['account.account'].invalidate_cache(['bankinplay_fingerprint'])
+
     def _get_account_plans(self, access_data):
         """Get account plans from bankingplay."""
-        url = BANKINPLAY_ENDPOINT_V1 + "/planes-contables"
-
-        data = self._get_request(access_data, url, {})
-        return data
+        return self._get_reference_data(access_data, "account_plans")
 
     def _set_company_account_plan(self, access_data, account_plan):
         url = BANKINPLAY_ENDPOINT_V2 + "/entidad/sociedades/" + \
@@ -122,51 +159,137 @@ class BankinPlayInterface(models.AbstractModel):
 
     # CONTACTOS
 
-    def _export_contacts(self, access_data, domain=[]):
+    def _export_contacts(self, access_data, domain=[], continuation=False,
+                         **continuation_args):
         url = BANKINPLAY_ENDPOINT_V1 + "/tercero-cliente"
         company_id = access_data.get('company_id', False)
 
         # domain.extend(['|', ('bankinplay_sent', '=', False), ('bankinplay_update', '=', True)])
 
-        contact_ids = self.env['res.partner'].search(domain)
+        contact_ids = self.env['res.partner'].search(domain).with_company(company_id)
+
+        def build(partners):
+            # Contacts are only sent again when their exported data changed.
+            contacts = []
+            hashes = {}
+            for partner, contact in zip(
+                    partners, self._prepare_contacts(partners, company_id)):
+                contact_hash = self._get_fingerprint(contact)
+                if partner.bankinplay_sent and partner.bankinplay_hash == contact_hash:
+                    continue
+                hashes[str(partner.id)] = contact_hash
+                contacts.append(contact)
+            if not contacts:
+                return None, {}
+            return {"terceros": contacts}, {"hashes": hashes}
+
+        return self._export_in_chunks(
+            access_data, url, contact_ids, build,
+            "_export_contacts_done", "tercero-cliente",
+            next_continuation=continuation, **continuation_args)
+
+    def _export_contacts_done(self, access_data, data, hashes=None,
+                              next_continuation=False, **continuation_args):
+        """Update the sent state of the contacts, then run the continuation."""
+        company_id = access_data.get('company_id', False)
+        hashes = dict(hashes or {})
+        terceros = data.get('terceros', []) if isinstance(data, dict) else []
+        rejected_vats = {
+            tercero.get('nif') for tercero in terceros
+            if isinstance(tercero, dict)
+            and tercero.get('estado', 'correcto') != 'correcto'
+        }
+        partners = self.env['res.partner'].browse(
+            [int(partner_id) for partner_id in hashes]).exists()
+        if rejected_vats:
+            partners = partners.filtered(lambda x: x.vat not in rejected_vats)
+        if partners:
+            partners.write({'bankinplay_sent': True})
+            self.env['ir.property'].sudo().with_company(company_id)._set_multi(
+                'bankinplay_hash', 'res.partner',
+                {partner.id: hashes[str(partner.id)] for partner in partners})
+        if next_continuation:
+            return getattr(self, next_continuation)(
+                access_data, data, **continuation_args)
+        return data
+
+    def _prepare_contacts(self, contact_ids, company_id):
+        """Contact payloads of ``contact_ids``, in the same order.
+
+        Partner fields are read in one pass, and the company dependent
+        accounts are resolved with one property query per company.
+        """
+        sociedad_cif = company_id.vat.replace('ES', '')
+        partners = contact_ids.read([
+            'vat', 'name', 'comercial', 'country_id', 'street', 'state_id',
+            'city', 'is_customer', 'is_supplier', 'employee',
+        ], load=False)
+
+        countries = {
+            country['id']: country['code']
+            for country in self.env['res.country'].browse(
+                {p['country_id'] for p in partners if p['country_id']}
+            ).read(['code'])
+        }
+        states = {
+            state['id']: state['name']
+            for state in self.env['res.country.state'].browse(
+                {p['state_id'] for p in partners if p['state_id']}
+            ).read(['name'])
+        }
+        property_model = self.env['ir.property'].sudo().with_company(company_id)
+        receivables = property_model._get_multi(
+            'property_account_receivable_id', 'res.partner', contact_ids.ids)
+        payables = property_model._get_multi(
+            'property_account_payable_id', 'res.partner', contact_ids.ids)
+        accounts = self.env['account.account'].sudo().browse(
+            {account.id for account in list(receivables.values())
+             + list(payables.values()) if account})
+        codes = {account['id']: account['code'] for account in accounts.read(['code'])}
+
         contacts = []
-        for c in contact_ids:
+        for c in partners:
+            receivable = receivables.get(c['id'])
+            payable = payables.get(c['id'])
+            receivable_code = codes.get(receivable.id, False) if receivable else False
+            payable_code = codes.get(payable.id, False) if payable else False
+
             configuracion_contable = []
-            if c.is_customer:
+            if c['is_customer']:
                 configuracion_contable.append({
-                    "sociedad_cif": company_id.vat.replace('ES', ''),
+                    "sociedad_cif": sociedad_cif,
                     "tipo_tercero": "C",
                     "estado": "A",
-                    "cuenta_contable": c.property_account_receivable_id.code,
-                    "codigo_tercero": c.id
+                    "cuenta_contable": receivable_code,
+                    "codigo_tercero": c['id']
                 })
 
-            if c.is_supplier:
+            if c['is_supplier']:
                 configuracion_contable.append({
-                    "sociedad_cif": company_id.vat.replace('ES', ''),
+                    "sociedad_cif": sociedad_cif,
                     "tipo_tercero": "P",
                     "estado": "A",
-                    "cuenta_contable": c.property_account_payable_id.code,
-                    "codigo_tercero": c.id
+                    "cuenta_contable": payable_code,
+                    "codigo_tercero": c['id']
                 })
 
-            if c.employee:
+            if c['employee']:
                 configuracion_contable.append({
-                    "sociedad_cif": company_id.vat.replace('ES', ''),
+                    "sociedad_cif": sociedad_cif,
                     "tipo_tercero": "E",
                     "estado": "A",
-                    "cuenta_contable": c.property_account_receivable_id.code,
-                    "codigo_tercero": c.id
+                    "cuenta_contable": receivable_code,
+                    "codigo_tercero": c['id']
                 })
 
             contact = {
-                "nif": c.vat,
-                "nombre": c.name,
-                "alias": c.comercial if c.comercial else '',
-                "pais": c.country_id.code if c.country_id else '',
-                "domicilio": c.street if c.street else '',
-                "provincia": c.state_id.name if c.state_id else '',
-                "localidad": c.city if c.city else '',
+                "nif": c['vat'],
+                "nombre": c['name'],
+                "alias": c['comercial'] if c['comercial'] else '',
+                "pais": countries.get(c['country_id'], ''),
+                "domicilio": c['street'] if c['street'] else '',
+                "provincia": states.get(c['state_id'], ''),
+                "localidad": c['city'] if c['city'] else '',
                 # "codigo_postal": c.zip if c.zip else '',
                 # "administracion_email": c.email or '',
                 # "telefono": c.phone if c.phone else c.mobile if c.mobile else '',
@@ -175,103 +298,9 @@ class BankinPlayInterface(models.AbstractModel):
 
             contacts.append(contact)
 
-        params = {
-            "terceros": contacts,
-        }
-
-        data = self._get_pending_async_request(
-            access_data, self._post_request(access_data, url, {}, json.dumps(params)))
-
-        # for tercero in data.get('terceros', []):
-        #     if tercero.get('estado', 'Incorrecto') == 'correcto':
-        #         partner = self.env['res.partner'].search([]).filtered(lambda x: tercero.get('nif', False) in x.vat if x.vat else False)
-        #         if partner:
-        #             partner.write({
-        #                 "bankinplay_sent": True
-        #             })
-
-        return data
+        return contacts
 
     # DOCUMENTOS TERCEROS
-    def _export_documents(self, access_data, start_date, journal_ids):
-        url = BANKINPLAY_ENDPOINT_V1 + "/documentos-terceros"
-
-        document_ids = self.env['account.move'].search([('invoice_date', '>', start_date), (
-            'state', '=', 'posted'), ('bankinplay_sent', '=', False), ('journal_id', 'in', journal_ids)])
-
-        for document in document_ids:
-            name_job = "[BANKINPLAY] - FACTURA " + document.name
-            document.with_delay(priority=20, max_retries=5,
-                                description=name_job).bankinplay_send_move()
-
-        return document_ids
-
-    def _export_document(self, access_data, move_id):
-
-        account_move_id = self.env['account.move'].search(
-            [('id', '=', move_id)], limit=1)
-
-        self._export_contact(access_data, self.env['res.partner'].search(
-            [('id', '=', account_move_id.partner_id.id)]).id)
-
-        url = BANKINPLAY_ENDPOINT_V1 + "/documentos-terceros"
-        company_id = access_data.get('company_id', False)
-
-        document_ids = self.env['account.move'].search(
-            [('id', '=', move_id)], limit=1)
-        documents = []
-
-        for d in document_ids:
-            estado_pago = "COBRADO" if d.payment_state == 'paid' else "PDTE",
-            tipo_documento_codigo = "FV"
-            if d.move_type == 'out_refund':
-                tipo_documento_codigo = "AC"
-                estado_pago = "COBRADO" if d.payment_state == 'paid' else "PDTE"
-            elif d.move_type == 'in_invoice':
-                tipo_documento_codigo = "FC"
-                estado_pago = "PAGADO" if d.payment_state == 'paid' else "PDTE",
-            elif d.move_type == 'in_refund':
-                tipo_documento_codigo = "AP"
-                estado_pago = "COBRADO" if d.payment_state == 'paid' else "PDTE",
-
-            document = {
-                "id_documento_erp": str(d.id),
-                "sociedad_cif": d.company_id.vat.replace('ES', ''),
-                "tipo_documento_codigo": tipo_documento_codigo,
-                "fecha_emision": d.invoice_date.strftime("%d/%m/%Y"),
-                "fecha_vencimiento": d.invoice_date_due.strftime("%d/%m/%Y"),
-                "fecha_emision_remesa": None,
-                "fecha_cobro": None,
-                "no_documento": d.name,
-                "no_remesa": None,
-                "importe_total": d.amount_total_signed,
-                "importe_pendiente": d.amount_residual_signed,
-                "importe_impuestos": d.amount_tax_signed,
-                "divisa": "EUR",
-                "estado_codigo": estado_pago,
-                "nif_tercero": d.partner_id.vat.replace('ES', ''),
-                "referencias": [d.ref] if d.ref else []
-            }
-            documents.append(document)
-
-        params = {
-            "documentos": documents,
-        }
-
-        data = self._get_pending_async_request(
-            access_data, self._post_request(access_data, url, {}, json.dumps(params)))
-
-        for tercero in data.get('documentos', []):
-            if tercero.get('estado', 'Incorrecto') == 'correcto':
-                move_line = self.env['account.move.line'].search(
-                    [('id', '=', tercero.get('id_documento_erp'))], limit=1)
-                if move_line:
-                    move_line.write({
-                        "bankinplay_sent": True,
-                    })
-
-        return data
-
     def _cancel_document(self, access_data, move_id):
 
         account_move_id = self.env['account.move'].search(
@@ -310,18 +339,104 @@ class BankinPlayInterface(models.AbstractModel):
                                 document_data.get('errors')[0]['description'])
 
     def _export_document_moves(self, access_data, start_date, journal_ids):
-        url = BANKINPLAY_ENDPOINT_V1 + "/documentos-terceros"
         company_id = access_data.get('company_id', False)
 
-        document_ids = self.env['account.move.line'].search([('company_id', '=', company_id.id), ('date', '>=', start_date), ("partner_id", '!=', False), ('parent_state', '=', 'posted'), (
-            'bankinplay_sent', '=', False), ('journal_id', 'in', journal_ids)]).filtered(lambda x: x.partner_id.vat and x.account_id.user_type_id.type in ['payable', 'receivable'])
-
-        # partner_ids = document_ids.mapped('partner_id').filtered(lambda x: not x.bankinplay_sent or x.bankinplay_update)
-        partner_ids = document_ids.mapped('partner_id')
-        if partner_ids:
-            self._export_contacts(access_data, [('id', 'in', partner_ids.ids)])
+        document_ids = self.env['account.move.line'].search([
+            ('company_id', '=', company_id.id),
+            ('date', '>=', start_date),
+            ('partner_id', '!=', False),
+            ('partner_id.vat', '!=', False),
+            ('parent_state', '=', 'posted'),
+            ('bankinplay_sent', '=', False),
+            ('journal_id', 'in', journal_ids),
+            ('account_id.internal_type', 'in', ['payable', 'receivable']),
+        ])
+
+        # Documents already sent that changed since, see bankinplay.document.outbox
+        outbox_model = self.env['bankinplay.document.outbox'].sudo()
+        document_ids |= outbox_model._get_pending(company_id).mapped(
+            'move_line_id').with_env(self.env).filtered(
+                lambda x: x.parent_state == 'posted')
+
+        requests = self.env['bankinplay.async.request']
+        batch_size = outbox_model._get_batch_size()
+        for start in range(0, len(document_ids), batch_size):
+            batch = document_ids[start:start + batch_size]
+            # partner_ids = batch.mapped('partner_id').filtered(lambda x: not x.bankinplay_sent or x.bankinplay_update)
+            partner_ids = batch.mapped('partner_id')
+            request = self._export_contacts(
+                access_data, [('id', 'in', partner_ids.ids)],
+                "_send_document_moves", line_ids=batch.ids)
+            if request:
+                # Nothing to wait for when no contact had to be sent, the
+                # documents are already linked to their own requests.
+                outbox_model._mark_sending(batch.ids, request[-1:])
+            requests |= request
+        return requests
+
+    def _send_document_moves(self, access_data, data, line_ids):
+        """Send the third-party documents once their contacts are exported.
+
+        Documents whose content did not change since they were last sent
+        are skipped.
+        """
+        url = BANKINPLAY_ENDPOINT_V1 + "/documentos-terceros"
+        company_id = access_data.get('company_id', False)
+        outbox_model = self.env['bankinplay.document.outbox'].sudo()
+
+        def build(chunk):
+            documents, hashes = self._prepare_documents(chunk, company_id)
+            if not documents:
+                return None, {}
+            return {"documentos": documents}, {"hashes": hashes}
+
+        return self._export_in_chunks(
+            access_data, url,
+            self.env['account.move.line'].browse(line_ids).exists(), build,
+            "_export_document_moves_done", "documentos-terceros",
+            on_chunk=lambda request, chunk_args: outbox_model._mark_sending(
+                [int(line_id) for line_id in chunk_args["hashes"]], request))
+
+    def _get_document_payment_orders(self, document_ids):
+        """Payment order remitting each of ``document_ids``, by line id.
+
+        The order comes from the first payment of the first payment line
+        of each document, read for all of them with a single query.
+        """
+        if not document_ids:
+            return {}
+        payment_field = self.env['account.payment.line']._fields['payment_ids']
+        self.env['account.payment.line'].flush(['move_line_id', 'payment_ids'])
+        self.env['account.payment'].flush(['payment_order_id'])
+        self.env.cr.execute("""
+            SELECT DISTINCT ON (pl.move_line_id) pl.move_line_id, p.payment_order_id
+            FROM account_payment_line pl
+            JOIN {relation} rel ON rel.{column1} = pl.id
+            JOIN account_payment p ON p.id = rel.{column2}
+            WHERE pl.move_line_id IN %s
+            ORDER BY pl.move_line_id, pl.id, p.id
+        """.format(
+            relation=payment_field.relation,
+            column1=payment_field.column1,
+            column2=payment_field.column2,
+        ), (tuple(document_ids.ids),))
+        order_ids = {
+            move_line_id: order_id
+            for move_line_id, order_id in self.env.cr.fetchall() if order_id
+        }
+        orders = self.env['account.payment.order'].browse(set(order_ids.values()))
+        orders.read(['name', 'date_uploaded'])
+        return {
+            move_line_id: orders.browse(order_id).with_prefetch(orders.ids)
+            for move_line_id, order_id in order_ids.items()
+        }
 
+    def _prepare_documents(self, document_ids, company_id):
+        """Documents of ``document_ids`` changed since last sent, and their hashes."""
         documents = []
+        hashes = {}
+        unchanged_ids = []
+        payment_orders = self._get_document_payment_orders(document_ids)
         for d in document_ids:
             tipo_documento_codigo = 'FC'
             if d.move_id.move_type == 'out_invoice':
@@ -334,11 +449,9 @@ class BankinPlayInterface(models.AbstractModel):
                 tipo_documento_codigo = "AP"
 
             amount_residual = abs(d.amount_residual)
-            payment_order_id = False
-            if d.payment_line_ids and d.payment_line_ids[:1].payment_ids and d.payment_line_ids[:1].payment_ids[:1].payment_order_id:
+            payment_order_id = payment_orders.get(d.id, False)
+            if payment_order_id:
                 amount_residual = abs(d.amount_currency)
-                payment_order_id = d.payment_line_ids[:
-                                                      1].payment_ids[:1].payment_order_id
 
             document_type = 'PDTE'
             if payment_order_id:
@@ -368,23 +481,37 @@ class BankinPlayInterface(models.AbstractModel):
                 "estado_codigo": document_type
             }
 
+            document_hash = self._get_fingerprint(document)
+            if d.bankinplay_sent and d.bankinplay_hash == document_hash:
+                unchanged_ids.append(d.id)
+                continue
+            hashes[str(d.id)] = document_hash
             documents.append(document)
 
-        params = {
-            "documentos": documents,
-        }
-
-        data = self._get_pending_async_request(
-            access_data, self._post_request(access_data, url, {}, json.dumps(params)))
+        self.env['bankinplay.document.outbox'].sudo()._mark_unchanged(
+            unchanged_ids)
+        return documents, hashes
 
+    def _export_document_moves_done(self, access_data, data, hashes=None):
+        hashes = hashes or {}
+        sent_ids = []
+        failed_ids = []
         for tercero in data.get('documentos', []):
+            line_id = str(tercero.get('id_documento_erp'))
+            if not line_id.isdigit():
+                continue
             if tercero.get('estado', 'Incorrecto') == 'correcto':
-                move_line = self.env['account.move.line'].search(
-                    [('id', '=', tercero.get('id_documento_erp'))], limit=1)
-                if move_line:
-                    move_line.write({
-                        "bankinplay_sent": True,
-                    })
+                sent_ids.append(int(line_id))
+            else:
+                failed_ids.append(int(line_id))
+
+        for move_line in self.env['account.move.line'].browse(sent_ids).exists():
+            move_line.write({
+                "bankinplay_sent": True,
+                "bankinplay_hash": hashes.get(str(move_line.id), False),
+            })
+        self.env['bankinplay.document.outbox'].sudo()._mark_sent(
+            sent_ids, failed_ids)
 
         return data
 
@@ -424,32 +551,99 @@ class BankinPlayInterface(models.AbstractModel):
         return analytic_line_id
 
     def _export_analytic_plan(self, access_data, analytic_line_id):
+        """Register the analytic accounts of the company as analytic codes.
 
+        BankInPlay has no bulk endpoint for codes, so they are posted from a
+        bounded pool of threads. Codes already registered in the analytic
+        line are skipped, see bankinplay.analytic.code.
+        """
         url = BANKINPLAY_ENDPOINT_V1 + "/codigo-analitico/lineas/" + \
             analytic_line_id + "/codigo"
         company_id = access_data.get('company_id', False)
         account_analytic_ids = self.env['account.analytic.account'].search(
             [('company_id', '=', company_id.id)])
-        analytics = []
-        for a in account_analytic_ids:
-            analytic = {
-                "codigo": a.name,
-            }
-            analytics.append(analytic)
-
-        params = {
-            "codigos": analytics
-        }
 
+        code_model = self.env['bankinplay.analytic.code'].sudo()
+        sent_codes = set(code_model.search(
+            [('analytic_line_id', '=', analytic_line_id)]).mapped('code'))
+        analytics = {}
         for a in account_analytic_ids:
-            params = {
-                "codigo": a.name,
-            }
-            data = self._post_request(access_data, url, {}, json.dumps(params))
-
+            if a.name not in sent_codes:
+                analytics.setdefault(a.name, a)
+        codes = list(analytics)
+
+        responses = self._post_concurrently(
+            access_data, url,
+            [json.dumps({"codigo": code}) for code in codes])
+
+        sent = []
+        errors = []
+        for code, response in zip(codes, responses):
+            if isinstance(response, Exception):
+                errors.append("%s: %s" % (code, response))
+            elif response.status_code not in (200, 201):
+                errors.append("%s: %s" % (code, response.text))
+            else:
+                sent.append(code)
+
+        code_model.create([{
+            'company_id': company_id.id,
+            'analytic_line_id': analytic_line_id,
+            'code': code,
+            'analytic_account_id': analytics[code].id,
+        } for code in sent])
+
+        data = {"enviados": sent, "errores": errors}
+        self.env['bankinplay.log']._log({
+            'operation_type': 'error' if errors else 'request',
+            'request_data': json.dumps(codes),
+            'response_data': json.dumps(data),
+            'status': 'error' if errors else 'success',
+            'triggered_event': str(url),
+        })
         return data
 
     # CONCILIACIÓN
+    def _get_statement_lines_by_movement(self, movement_ids):
+        """Unreconciled statement lines of ``movement_ids``, by movement."""
+        lines_by_movement = {}
+        statement_lines = self.env['account.bank.statement.line'].search([
+            ('is_reconciled', '=', False),
+            ('bankinplay_movement_id', 'in', list(movement_ids)),
+        ])
+        for statement_line in statement_lines:
+            lines_by_movement.setdefault(
+                statement_line.bankinplay_movement_id,
+                self.env['account.bank.statement.line'])
+            lines_by_movement[statement_line.bankinplay_movement_id] |= statement_line
+        return lines_by_movement
+
+    def _match_statement_line(self, lines_by_movement, cuenta_bancaria, movement_id):
+        """Statement line imported from ``movement_id`` of ``cuenta_bancaria``."""
+        return lines_by_movement.get(
+            movement_id, self.env['account.bank.statement.line']
+        ).filtered(
+            lambda x: x.unique_import_id == "%s-%s-%s" % (
+                cuenta_bancaria, x.journal_id.id, movement_id)
+        )[:1]
+
+    def _get_conciliation_move_lines(self, documentos):
+        """Posted payable/receivable lines of ``documentos`` by their id."""
+        move_line_ids = {
+            int(doc['id_documento_erp']) for doc in documentos
+            if str(doc.get('id_documento_erp') or '').isdigit()
+        }
+        move_lines = self.env['account.move.line'].search([
+            ('id', 'in', list(move_line_ids)),
+            ('parent_state', '=', 'posted'),
+            ('account_id.internal_type', 'in', ['payable', 'receivable']),
+        ])
+        # Fields used when building and reconciling the counterparts.
+        move_lines.read(
+            ['name', 'debit', 'reconciled', 'partner_id', 'account_id', 'move_id'],
+            load=False)
+        return {str(move_line.id): move_line for move_line in move_lines}
+
     def _import_conciliate_documents(self, access_data):
         url = BANKINPLAY_ENDPOINT_V1 + "/conciliacion-terceros"
         company_id = access_data.get('company_id', False)
@@ -467,19 +661,20 @@ class BankinPlayInterface(models.AbstractModel):
             params['fecha_conciliacion_desde'] = company_id.bankinplay_start_date.strftime(
                 "%d/%m/%Y")
 
-        data = self._get_pending_async_request(
-            access_data, self._post_request(access_data, url, {}, json.dumps(params)))
+        return self._register_async_request(
+            access_data,
+            self._post_request(access_data, url, {}, json.dumps(params)),
+            "_import_conciliate_documents_done", "conciliacion-terceros")
 
+    def _import_conciliate_documents_done(self, access_data, data):
+        company_id = access_data.get('company_id', False)
         if data.get('sociedades'):
             sociedades = data.get('sociedades', [])
 
             if sociedades:
                 documentos = sociedades[0].get('documentos', [])
 
-                payable_account_type = self.env.ref(
-                    "account.data_account_type_payable")
-                receivable_account_type = self.env.ref(
-                    "account.data_account_type_receivable")
+                move_lines = self._get_conciliation_move_lines(documentos)
 
                 documentos_por_movimiento = {}
                 for doc in documentos:
@@ -491,76 +686,63 @@ class BankinPlayInterface(models.AbstractModel):
 
                 # _logger.info("DOCUMENTOS POR MOVIMIENTO: %s", documentos_por_movimiento)
 
-                for id_movimiento, docs in documentos_por_movimiento.items():
-                    _logger.info(
-                        f"ID Movimiento: {id_movimiento} - Total documentos: {len(docs)}")
-                    statement_line = self.env['account.bank.statement.line'].search([
-                        ('is_reconciled', '=', False),
-                        ('unique_import_id', 'like', id_movimiento)
-                    ], limit=1)
-
-                    if statement_line:
-                        cuenta_bancaria = docs[0].get('cuenta_bancaria', '')
-                        number = f"{cuenta_bancaria}-{statement_line.journal_id.id}-{id_movimiento}"
-
-                        if statement_line.unique_import_id == number:
-
-                            try:
-                                if statement_line.is_reconciled:
-                                    statement_line.button_undo_reconciliation()
-
-                                counterparts = []
-
-                                for conciliation in docs:
-                                    move_line_id = conciliation.get(
-                                        'id_documento_erp')
-
-                                    if move_line_id:
-                                        move_line = self.env['account.move.line'].search([
-                                            ('id', '=', int(move_line_id)),
-                                            ('parent_state', '=', 'posted')
-                                        ], limit=1)
-
-                                        if move_line and move_line.account_id.user_type_id in [payable_account_type, receivable_account_type]:
-
-                                            debit = 0
-                                            credit = 0
-
-                                            importe_conciliado = abs(
-                                                conciliation.get('importe_conciliado', 0))
-
-                                            if move_line.debit:
-                                                credit = importe_conciliado
-                                            else:
-                                                debit = importe_conciliado
-
-                                            counterparts.append({
-                                                'name': move_line.name,
-                                                'credit': credit,
-                                                'debit': debit,
-                                                'move_line': move_line,
-                                            })
-
-                                if counterparts:
-                                    statement_line.process_reconciliation_oca(
-                                        counterparts,
-                                        [],
-                                        []
-                                    )
-                                    self.env.cr.commit()
-
-                            except Exception as e:
-                                error = f"Error al conciliar documento: {e}"
-                                _logger.error(error)
-                                self.env['bankinplay.log'].create({
-                                    'operation_type': 'error',
-                                    'response_data': error,
-                                    'status': 'error',
-                                })
+                lines_by_movement = self._get_statement_lines_by_movement(
+                    documentos_por_movimiento.keys())
+
+                failed = self._process_in_batches(
+                    [(id_movimiento, (id_movimiento, docs))
+                     for id_movimiento, docs in documentos_por_movimiento.items()],
+                    lambda item: self._conciliate_movement(
+                        lines_by_movement, move_lines, *item))
+                # Failed movements are requested again by the next run.
+                if failed:
+                    return
 
         company_id.bankinplay_last_syncdate = datetime.today()
 
-    def _import_account_moves(self, access_data):
+    def _conciliate_movement(self, lines_by_movement, move_lines, id_movimiento, docs):
+        """Reconcile the statement line of a movement with its documents."""
+        _logger.info(
+            f"ID Movimiento: {id_movimiento} - Total documentos: {len(docs)}")
+        cuenta_bancaria = docs[0].get('cuenta_bancaria', '')
+        statement_line = self._match_statement_line(
+            lines_by_movement, cuenta_bancaria, id_movimiento)
+        if not statement_line or statement_line.is_reconciled:
+            return
+
+        counterparts = []
+
+        for conciliation in docs:
+            move_line_id = conciliation.get('id_documento_erp')
+
+            move_line = move_lines.get(str(move_line_id))
+            if move_line:
+                debit = 0
+                credit = 0
+
+                importe_conciliado = abs(
+                    conciliation.get('importe_conciliado', 0))
+
+                if move_line.debit:
+                    credit = importe_conciliado
+                else:
+                    debit = importe_conciliado
+
+                counterparts.append({
+                    'name': move_line.name,
+                    'credit': credit,
+                    'debit': debit,
+                    'move_line': move_line,
+                })
+
+        if counterparts:
+            statement_line.process_reconciliation_oca(
+                counterparts,
+                [],
+                []
+            )
+
+    def _import_account_moves(self, access_data, full_resync=False):
         url = BANKINPLAY_ENDPOINT_V1 + "/asientoContableApi/asiento_contable"
         company_id = access_data.get('company_id', False)
         params = {
@@ -569,84 +751,202 @@ class BankinPlayInterface(models.AbstractModel):
             "deshabilitar_callback": True
         }
 
-        data = self._get_pending_async_request(
-            access_data, self._post_request(access_data, url, {}, json.dumps(params)))
+        if company_id.bankinplay_last_account_move_syncdate and not full_resync:
+            params['fechaDesde'] = (
+                company_id.bankinplay_last_account_move_syncdate - relativedelta(days=2)).strftime("%d/%m/%Y")
 
+        return self._register_async_request(
+            access_data,
+            self._post_request(access_data, url, {}, json.dumps(params)),
+            "_import_account_moves_done", "asiento_contable",
+            sync_date=fields.Date.to_string(fields.Date.today()))
+
+    def _import_account_moves_done(self, access_data, data, sync_date=False):
+        company_id = access_data.get('company_id', False)
         _logger.info("DATA: %s", data)
 
-        for asiento in data.get('results').get('asientos'):
-            statement_line = self.env['account.bank.statement.line'].search([('is_reconciled', '=', False)]).filtered(
-                lambda x: str(asiento.get('movimiento_id')) in x.unique_import_id)
-            if statement_line and not statement_line.is_reconciled:
-                journal_id = statement_line.journal_id
-                cuenta_bancaria = asiento.get('cuenta_bancaria')
-                number = (cuenta_bancaria + '-'
-                          + str(journal_id.id)
-                          + "-"
-                          + str(asiento.get('movimiento_id'))
-                          )
-                if statement_line.unique_import_id == number:
-
-                    statement_line.line_ids.remove_move_reconcile()
-                    statement_line.payment_ids.unlink()
-
-                    new_line_vals = []
-
-                    for apunte in asiento.get('apuntes'):
-                        if apunte.get('cuenta_contable') != journal_id.default_account_id.code:
-                            account_account = self.env['account.account'].search([('code', '=', apunte.get(
-                                'cuenta_contable')), ('company_id', '=', company_id.id)], limit=1)
-                            if not account_account:
-                                raise UserError(
-                                    _("Account %s not found in the system." % apunte.get('cuenta_contable')))
-
-                            credit = 0
-                            debit = 0
-                            if apunte.get('debe_haber') == 'D':
-                                credit = apunte.get('importe')
-                            else:
-                                debit = apunte.get('importe')
-
-                            analytic_account_id = False
-                            if apunte.get('analitica'):
-                                for analitica in apunte.get('analitica'):
-                                    for desglose in analitica.get('desglose'):
-                                        account_analytic = self.env['account.analytic.account'].search(
-                                            [('name', '=', desglose.get('codigo_analitico')), ('company_id', '=', company_id.id)], limit=1)
-                                        if not account_analytic:
-                                            raise UserError(_("Analytic Account %s not found in the system." % desglose.get('codigo_analitico'))
-                                                            )
-                                        analytic_account_id = account_analytic.id
-
-                            new_line_vals.append({
-                                'name': asiento.get('descripcion'),
-                                'credit': debit,
-                                'debit': credit,
-                                'account_id': account_account.id,
-                                'analytic_account_id': analytic_account_id
-
-                            })
-
-                    moves = statement_line.process_reconciliation_oca(
-                        [],
-                        [],
-                        new_line_vals
-                    )
-
-                    statement_line.write({'bankinplay_conciliation': True})
-                    self.env.cr.commit()
+        asientos = data.get('results').get('asientos')
+        lines_by_movement = self._get_statement_lines_by_movement(
+            {str(asiento.get('movimiento_id')) for asiento in asientos})
+
+        accounts, analytic_accounts = self._get_account_move_lookups(
+            company_id, asientos)
+
+        failed = self._process_in_batches(
+            [(asiento.get('movimiento_id'), asiento) for asiento in asientos],
+            lambda asiento: self._import_account_move(
+                lines_by_movement, accounts, analytic_accounts, asiento))
+
+        # Asientos are requested again from this date on by the next run.
+        if sync_date:
+            company_id.bankinplay_last_account_move_syncdate = \
+                self._get_account_move_syncdate(
+                    company_id, asientos, failed, sync_date)
 
         return data
 
+    def _get_account_move_syncdate(self, company_id, asientos, failed, sync_date):
+        """Date the next import requests asientos from.
+
+        It does not go past the oldest asiento that failed or whose movement
+        is not imported yet, so that they are requested again. The date is
+        kept as it was when one of them has no date.
+        """
+        movement_ids = {
+            str(asiento.get('movimiento_id')) for asiento in asientos}
+        imported = set(self.env['account.bank.statement.line'].search([
+            ('company_id', '=', company_id.id),
+            ('bankinplay_movement_id', 'in', list(movement_ids)),
+        ]).mapped('bankinplay_movement_id'))
+        syncdate = fields.Date.to_date(sync_date)
+        for asiento in asientos:
+            movement_id = str(asiento.get('movimiento_id'))
+            if movement_id in imported and movement_id not in failed:
+                continue
+            try:
+                date = datetime.strptime(
+                    asiento.get('fecha_contable') or '', "%d/%m/%Y").date()
+            except ValueError:
+                return company_id.bankinplay_last_account_move_syncdate
+            syncdate = min(syncdate, date)
+        return syncdate
+
+    def _get_account_move_lookups(self, company_id, asientos):
+        """Accounts by code and analytic accounts by name of ``asientos``.
+
+        Both are read with a single query for the company, codes unknown in
+        the system are reported together.
+        """
+        codes = set()
+        analytic_codes = set()
+        for asiento in asientos:
+            for apunte in asiento.get('apuntes') or []:
+                codes.add(apunte.get('cuenta_contable'))
+                for analitica in apunte.get('analitica') or []:
+                    for desglose in analitica.get('desglose') or []:
+                        analytic_codes.add(desglose.get('codigo_analitico'))
+
+        accounts = {}
+        for account in self.env['account.account'].search_read(
+                [('code', 'in', list(codes)), ('company_id', '=', company_id.id)],
+                ['code']):
+            accounts.setdefault(account['code'], account['id'])
+        analytic_accounts = {}
+        for analytic in self.env['account.analytic.account'].search_read(
+                [('name', 'in', list(analytic_codes)), ('company_id', '=', company_id.id)],
+                ['name']):
+            analytic_accounts.setdefault(analytic['name'], analytic['id'])
+
+        missing_codes = sorted(str(code) for code in codes - set(accounts))
+        missing_analytics = sorted(
+            str(code) for code in analytic_codes - set(analytic_accounts))
+        if missing_codes or missing_analytics:
+            error = _("Accounts not found in the system: %s. "
+                      "Analytic Accounts not found in the system: %s.") % (
+                ", ".join(missing_codes) or "-",
+                ", ".join(missing_analytics) or "-")
+            _logger.warning(error)
+            self.env['bankinplay.log']._log({
+                'operation_type': 'error',
+                'response_data': error,
+                'triggered_event': 'asiento_contable',
+                'status': 'error',
+            })
+        return accounts, analytic_accounts
+
+    def _import_account_move(self, lines_by_movement, accounts, analytic_accounts, asiento):
+        """Reconcile the statement line of an asiento with its apuntes."""
+        statement_line = self._match_statement_line(
+            lines_by_movement, asiento.get('cuenta_bancaria'),
+            str(asiento.get('movimiento_id')))
+        if not statement_line or statement_line.is_reconciled:
+            return
+        journal_id = statement_line.journal_id
+
+        statement_line.line_ids.remove_move_reconcile()
+        statement_line.payment_ids.unlink()
+
+        new_line_vals = []
+        missing_codes = []
+
+        for apunte in asiento.get('apuntes'):
+            if apunte.get('cuenta_contable') != journal_id.default_account_id.code:
+                account_id = accounts.get(apunte.get('cuenta_contable'))
+                if not account_id:
+                    missing_codes.append(
+                        _("Account %s") % apunte.get('cuenta_contable'))
+
+                credit = 0
+                debit = 0
+                if apunte.get('debe_haber') == 'D':
+                    credit = apunte.get('importe')
+                else:
+                    debit = apunte.get('importe')
+
+                analytic_account_id = False
+                if apunte.get('analitica'):
+                    for analitica in apunte.get('analitica'):
+                        for desglose in analitica.get('desglose'):
+                            analytic_account_id = analytic_accounts.get(
+                                desglose.get('codigo_analitico'))
+                            if not analytic_account_id:
+                                missing_codes.append(
+                                    _("Analytic Account %s") % desglose.get('codigo_analitico'))
+
+                new_line_vals.append({
+                    'name': asiento.get('descripcion'),
+                    'credit': debit,
+                    'debit': credit,
+                    'account_id': account_id,
+                    'analytic_account_id': analytic_account_id or False
+
+                })
+
+        if missing_codes:
+            raise UserError(
+                _("Not found in the system: %s") % ", ".join(missing_codes))
+
+        statement_line.process_reconciliation_oca(
+            [],
+            [],
+            new_line_vals
+        )
+
+        statement_line.write({'bankinplay_conciliation': True})
+
     def _export_account_move_lines(self, access_data):
         url = BANKINPLAY_ENDPOINT_V1 + "/apunteContableApi/apunte_contable"
         company_id = access_data.get('company_id', False)
 
-        statement_line_ids = self.env['account.bank.statement.line'].search([('is_reconciled', '=', True), ('company_id', '=', company_id.id)]).filtered(
-            lambda x: x.unique_import_id and x.date >= company_id.bankinplay_start_date and not x.bankinplay_sent)
+        statement_line_ids = self.env['account.bank.statement.line'].search([
+            ('is_reconciled', '=', True),
+            ('company_id', '=', company_id.id),
+            ('unique_import_id', '!=', False),
+            ('date', '>=', company_id.bankinplay_start_date),
+            ('bankinplay_sent', '=', False),
+        ])
+
+        # Apuntes are sent one chunk at a time, each one marked as sent.
+        data = {}
+        chunk_size = self._get_export_chunk_size()
+        for start in range(0, len(statement_line_ids), chunk_size):
+            chunk = statement_line_ids[start:start + chunk_size].with_prefetch()
+            params = {
+                "apuntes": self._prepare_account_move_lines(chunk)
+            }
+
+            data = self._post_request(access_data, url, {}, json.dumps(params))
+
+            chunk.write({'bankinplay_sent': True})
+            chunk.flush()
+            chunk.invalidate_cache(ids=chunk.ids)
+
+        return data
+
+    def _prepare_account_move_lines(self, statement_line_ids):
         account_move_lines = []
         for st in statement_line_ids:
-            movimiento_id = st.unique_import_id.split('-')[-1]
+            movimiento_id = st.bankinplay_movement_id
             account_code = st.move_id.journal_id.default_account_id.code
 
             for line in st.move_id.line_ids.filtered(lambda x: x.account_id.code == account_code):
@@ -664,13 +964,4 @@ class BankinPlayInterface(models.AbstractModel):
 
                 account_move_lines.append(account_move_line)
 
-        params = {
-            "apuntes": account_move_lines
-        }
-
-        data = self._post_request(access_data, url, {}, json.dumps(params))
-
-        for st in statement_line_ids:
-            st.bankinplay_sent = True
-
-        return data
+        return account_move_lines
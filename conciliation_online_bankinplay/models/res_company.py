@@ -58,6 +58,18 @@ class ResCompany(models.Model):
         help="Last Sync Date.",
     )    
 
+    bankinplay_last_account_move_syncdate = fields.Date(
+        string="Last Account Moves Sync Date",
+        help="Account moves (asientos) are imported from this date on, "
+        "empty for a full import.",
+    )
+
+    bankinplay_account_plan_fingerprint = fields.Char(
+        string="Account Plan Fingerprint",
+        copy=False,
+        help="Fingerprint of the account plan settings last sent to BankInPlay.",
+    )
+
     bankinplay_partner_domain = fields.Char(
         string="Partner Domain",
         help="Partner Domain.",
@@ -99,10 +111,10 @@ class ResCompany(models.Model):
         interface_model = self.env["bankinplay.interface"]
         interface_model._import_conciliate_documents(access_data)
         
-    def bankinplay_import_account_moves(self):
+    def bankinplay_import_account_moves(self, full_resync=False):
         access_data = self.check_bankinplay_connection()
         interface_model = self.env["bankinplay.interface"]
-        interface_model._import_account_moves(access_data)
+        interface_model._import_account_moves(access_data, full_resync)
 
     def export_analytic_plan(self):
         access_data = self.check_bankinplay_connection()
@@ -138,6 +150,9 @@ class ResCompany(models.Model):
     def bankinplay_import_account_moves_button(self):
         self.with_context(company_id=self.id).with_delay().bankinplay_import_account_moves()
 
+    def bankinplay_resync_account_moves_button(self):
+        self.with_context(company_id=self.id).with_delay().bankinplay_import_account_moves(full_resync=True)
+
     def bankinplay_export_account_move_line_button(self):
         self.with_context(company_id=self.id).with_delay().bankinplay_export_account_move_line()
 
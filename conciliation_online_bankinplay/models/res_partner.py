@@ -19,6 +19,12 @@ class ResPartner(models.Model):
     _inherit = "res.partner"
 
     bankinplay_sent = fields.Boolean(string="Bankinplay sent", default=False)
+    bankinplay_hash = fields.Char(
+        string="Bankinplay hash",
+        company_dependent=True,
+        copy=False,
+        help="Hash of the contact data last sent to Bankinplay.",
+    )
 
     def bankinplay_send_partner(self):
         for record in self:
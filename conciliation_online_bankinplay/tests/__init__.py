@@ -0,0 +1,3 @@
+from . import test_bankinplay_conciliation
+from . import test_bankinplay_document_outbox
+from . import test_bankinplay_fingerprint
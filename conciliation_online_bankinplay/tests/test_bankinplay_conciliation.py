@@ -0,0 +1,86 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+from unittest import mock
+
+from odoo.tests import tagged
+
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+
+
+@tagged("post_install", "-at_install")
+class TestBankinplayConciliation(AccountTestInvoicingCommon):
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls.company = cls.company_data["company"]
+        cls.interface_model = cls.env["bankinplay.interface"]
+        cls.access_data = {"company_id": cls.company}
+        cls.journal = cls.company_data["default_journal_bank"]
+        cls.statement = cls.env["account.bank.statement"].create({
+            "name": "BankInPlay",
+            "journal_id": cls.journal.id,
+            "line_ids": [(0, 0, {
+                "payment_ref": "Cobro",
+                "amount": 200.0,
+                "unique_import_id": "ES0012-%s-123" % cls.journal.id,
+            })],
+        })
+        cls.statement_line = cls.statement.line_ids
+        cls.documents = cls.env["account.move.line"]
+        for _i in range(2):
+            invoice = cls.init_invoice(
+                "out_invoice", amounts=[100.0], post=True)
+            cls.documents |= invoice.line_ids.filtered(
+                lambda x: x.account_id.internal_type == "receivable")
+
+    def _get_response(self, documents):
+        return {"sociedades": [{"documentos": [{
+            "id_movimiento": 123,
+            "cuenta_bancaria": "ES0012",
+            "id_documento_erp": str(document.id),
+            "importe_conciliado": document.balance,
+        } for document in documents]}]}
+
+    def _import_conciliate_documents_done(self, data, side_effect=None):
+        with mock.patch.object(self.env.cr, "commit"), mock.patch.object(
+            type(self.statement_line), "process_reconciliation_oca",
+            create=True, side_effect=side_effect,
+        ) as process_reconciliation:
+            self.interface_model._import_conciliate_documents_done(
+                self.access_data, data)
+        return process_reconciliation
+
+    def test_conciliate_single_document(self):
+        process_reconciliation = self._import_conciliate_documents_done(
+            self._get_response(self.documents[:1]))
+        process_reconciliation.assert_called_once()
+        counterparts = process_reconciliation.call_args[0][0]
+        self.assertEqual(
+            [c["move_line"] for c in counterparts], list(self.documents[:1]))
+        self.assertEqual(
+            counterparts[0]["credit"], self.documents[0].balance)
+        self.assertTrue(self.company.bankinplay_last_syncdate)
+
+    def test_conciliate_several_documents(self):
+        process_reconciliation = self._import_conciliate_documents_done(
+            self._get_response(self.documents))
+        process_reconciliation.assert_called_once()
+        counterparts = process_reconciliation.call_args[0][0]
+        self.assertEqual(
+            [c["move_line"] for c in counterparts], list(self.documents))
+
+    def test_failed_movement_keeps_syncdate(self):
+        self.company.bankinplay_last_syncdate = False
+        self._import_conciliate_documents_done(
+            self._get_response(self.documents),
+            side_effect=Exception("Reconciliation failed"))
+        self.assertFalse(self.company.bankinplay_last_syncdate)
+
+    def test_movement_parsed_from_import_id(self):
+        self.assertEqual(self.statement_line.bankinplay_account, "ES0012")
+        self.assertEqual(self.statement_line.bankinplay_movement_id, "123")
+        # Providers without an account number, such as cards.
+        self.statement_line.unique_import_id = "%s-456" % self.journal.id
+        self.assertFalse(self.statement_line.bankinplay_account)
+        self.assertEqual(self.statement_line.bankinplay_movement_id, "456")
+        self.statement_line.unique_import_id = "456"
+        self.assertFalse(self.statement_line.bankinplay_movement_id)
@@ -0,0 +1,114 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+from unittest import mock
+
+from odoo import fields
+from odoo.tests import tagged
+
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+
+
+@tagged("post_install", "-at_install")
+class TestBankinplayDocumentOutbox(AccountTestInvoicingCommon):
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls.company = cls.company_data["company"]
+        cls.company.bankinplay_enabled = True
+        cls.outbox_model = cls.env["bankinplay.document.outbox"]
+        cls.invoice = cls.init_invoice(
+            "out_invoice", products=cls.product_a, post=True)
+        cls.document = cls.invoice.line_ids.filtered(
+            lambda x: x.account_id.internal_type == "receivable")
+
+    def _get_entry(self):
+        return self.outbox_model.search(
+            [("move_line_id", "=", self.document.id)])
+
+    def _change_document(self):
+        self.document.date_maturity = fields.Date.add(
+            self.document.date_maturity, days=1)
+
+    def test_unsent_document_not_queued(self):
+        self._change_document()
+        self.assertFalse(self._get_entry())
+
+    def test_changed_document_queued_once(self):
+        self.document.bankinplay_sent = True
+        self.assertFalse(self._get_entry())
+        self._change_document()
+        self._change_document()
+        entry = self._get_entry()
+        self.assertEqual(len(entry), 1)
+        self.assertEqual(entry.company_id, self.company)
+        self.assertEqual(self.outbox_model._get_pending(self.company), entry)
+
+    def test_pending_until_sent(self):
+        self.document.bankinplay_sent = True
+        self._change_document()
+        entry = self._get_entry()
+        request = self.env["bankinplay.async.request"].create({
+            "response_id": "test-outbox",
+            "company_id": self.company.id,
+        })
+        self.outbox_model._mark_sending(self.document.ids, request)
+        self.assertEqual(entry.request_id, request)
+        self.assertFalse(self.outbox_model._get_pending(self.company))
+        # The continuation never marked the entry as sent.
+        request.state = "done"
+        self.assertEqual(self.outbox_model._get_pending(self.company), entry)
+        self.outbox_model._mark_sent([self.document.id], [])
+        self.assertFalse(entry.exists())
+
+    def test_changed_while_sending_queued_again(self):
+        self.document.bankinplay_sent = True
+        self._change_document()
+        request = self.env["bankinplay.async.request"].create({
+            "response_id": "test-outbox",
+            "company_id": self.company.id,
+        })
+        self.outbox_model._mark_sending(self.document.ids, request)
+        self._change_document()
+        self.assertFalse(self._get_entry().request_id)
+
+    def test_payment_order_feeds_outbox(self):
+        self.document.bankinplay_sent = True
+        payment_mode = self.env["account.payment.mode"].create({
+            "name": "Test inbound mode",
+            "company_id": self.company.id,
+            "bank_account_link": "variable",
+            "payment_method_id": self.env.ref(
+                "account.account_payment_method_manual_in").id,
+        })
+        order = self.env["account.payment.order"].create({
+            "payment_mode_id": payment_mode.id,
+            "payment_type": "inbound",
+        })
+        self.document.create_payment_line_from_move_line(order)
+        order.write({"date_uploaded": fields.Date.today()})
+        self.assertTrue(self._get_entry())
+        self._get_entry().unlink()
+        order.payment_line_ids.unlink()
+        self.assertTrue(self._get_entry())
+
+    def test_unchanged_document_dropped_without_contacts(self):
+        self.company.vat = "ESA12345674"
+        interface_model = self.env["bankinplay.interface"]
+        access_data = {"company_id": self.company}
+        partner = self.document.partner_id
+        # The contact and the document are already sent as they are now.
+        contact = interface_model._prepare_contacts(partner, self.company)[0]
+        interface_model._export_contacts_done(access_data, {}, hashes={
+            str(partner.id): interface_model._get_fingerprint(contact)})
+        self.document.bankinplay_sent = True
+        hashes = interface_model._prepare_documents(
+            self.document, self.company)[1]
+        self.document.bankinplay_hash = hashes[str(self.document.id)]
+        self.outbox_model._add_lines(self.document)
+        self.assertTrue(self._get_entry())
+        with mock.patch.object(
+            type(interface_model), "_post_request"
+        ) as post_request:
+            interface_model._export_document_moves(
+                access_data, self.document.date, self.document.journal_id.ids)
+        post_request.assert_not_called()
+        self.assertFalse(self._get_entry())
@@ -0,0 +1,67 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+from unittest import mock
+
+from odoo import fields
+from odoo.tests import tagged
+
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+
+
+@tagged("post_install", "-at_install")
+class TestBankinplayFingerprint(AccountTestInvoicingCommon):
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls.company = cls.company_data["company"]
+        cls.company.vat = "ESA12345674"
+        cls.interface_model = cls.env["bankinplay.interface"]
+        cls.access_data = {"company_id": cls.company}
+        cls.start_date = fields.Date.today()
+
+    def _export_account_plan(self):
+        """Accounts the account plan export would send."""
+        with mock.patch.object(
+            type(self.interface_model), "_export_in_chunks"
+        ) as export_in_chunks:
+            self.interface_model._export_account_plan(
+                self.access_data, self.start_date)
+        if not export_in_chunks.called:
+            return self.env["account.account"]
+        args = export_in_chunks.call_args
+        accounts = args[0][2]
+        fingerprints = {}
+        for start in range(0, len(accounts), 100):
+            fingerprints.update(
+                args[0][3](accounts[start:start + 100])[1]["fingerprints"])
+        # Store the fingerprints as the continuation does once sent.
+        self.interface_model._set_account_fingerprints(fingerprints)
+        self.company.bankinplay_account_plan_fingerprint = \
+            args[1]["plan_fingerprint"]
+        return accounts
+
+    def test_get_fingerprint(self):
+        fingerprint = self.interface_model._get_fingerprint(["430000", "A"])
+        self.assertEqual(
+            fingerprint,
+            self.interface_model._get_fingerprint(["430000", "A"]))
+        self.assertNotEqual(
+            fingerprint,
+            self.interface_model._get_fingerprint(["430000", "B"]))
+
+    def test_export_changed_accounts_only(self):
+        accounts = self.env["account.account"].search(
+            [("company_id", "=", self.company.id)])
+        self.assertEqual(self._export_account_plan(), accounts)
+        self.assertTrue(all(accounts.mapped("bankinplay_fingerprint")))
+        self.assertFalse(self._export_account_plan())
+        account = accounts[0]
+        account.name = "%s renamed" % account.name
+        self.assertEqual(self._export_account_plan(), account)
+
+    def test_export_all_accounts_when_plan_changes(self):
+        accounts = self.env["account.account"].search(
+            [("company_id", "=", self.company.id)])
+        self._export_account_plan()
+        self.company.bankinplay_manage_third_accounts = \
+            not self.company.bankinplay_manage_third_accounts
+        self.assertEqual(self._export_account_plan(), accounts)